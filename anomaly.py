@@ -0,0 +1,242 @@
+import logging
+
+import numpy as np
+
+# Streaming anomaly detection for heartbeat delay and inter-arrival period.
+#
+# Per-client statistics are kept in column arrays indexed by client slot, so
+# that scoring every client is a handful of vectorized NumPy operations rather
+# than a Python loop over clients.
+#
+# Each metric is tracked by two EWMAs: a fast one following recent behaviour
+# and a slow one acting as the client's baseline. A client is flagged when the
+# fast mean drifts away from the baseline (rising delay, stretching period),
+# when the fast variance grows well beyond the baseline variance (growing
+# jitter) or when it has been silent for much longer than its usual period.
+
+REASONS = ('delay', 'jitter', 'period', 'silence')
+
+
+class FleetStats:
+    def __init__(self, capacity=1024, fast_alpha=0.3, slow_alpha=0.02,
+        threshold=4.0, jitter_ratio=4.0, warmup=10, min_std_ms=1.0,
+        rel_std=0.05):
+        self.fast_alpha = fast_alpha
+        self.slow_alpha = slow_alpha
+        self.threshold = threshold  # Number of baseline std devs
+        self.jitter_ratio = jitter_ratio
+        self.warmup = warmup  # Sweeps with samples before a client is scored
+        # Floor for the baseline std dev, so that very steady clients are not
+        # flagged for sub-millisecond changes
+        self.min_std_ms = min_std_ms
+        self.rel_std = rel_std
+
+        self.slots = {}  # Client -> slot
+        self.clients = [None] * capacity  # Slot -> client
+        self.free_slots = list(range(capacity - 1, -1, -1))
+
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        def grow(name, dtype=np.float64):
+            old = getattr(self, name, None)
+            new = np.zeros(capacity, dtype=dtype)
+            if old is not None:
+                new[:len(old)] = old
+            setattr(self, name, new)
+
+        grow('active', dtype=bool)
+
+        # Accumulated since the last sweep
+        grow('delay_sum')
+        grow('delay_count', dtype=np.int64)
+        grow('period_sum')
+        grow('period_count', dtype=np.int64)
+        grow('last_arrival')
+
+        # Number of sweeps with samples, then fast and slow EWMA mean/variance
+        # per metric
+        for metric in ('delay', 'period'):
+            grow(f'{metric}_samples', dtype=np.int64)
+            for speed in ('fast', 'slow'):
+                grow(f'{speed}_{metric}_mean')
+                grow(f'{speed}_{metric}_var')
+
+    def __len__(self):
+        return len(self.slots)
+
+    @property
+    def capacity(self):
+        return len(self.clients)
+
+    def add_client(self, client):
+        if client in self.slots:
+            return self.slots[client]
+
+        if not self.free_slots:
+            # Double capacity so that adding clients stays amortized O(1)
+            old_capacity = self.capacity
+            self._allocate(old_capacity * 2)
+            self.clients.extend([None] * old_capacity)
+            self.free_slots = list(range(old_capacity * 2 - 1,
+                old_capacity - 1, -1))
+
+        slot = self.free_slots.pop()
+        self.slots[client] = slot
+        self.clients[slot] = client
+        self._reset_slot(slot)
+        self.active[slot] = True
+
+        return slot
+
+    def remove_client(self, client):
+        slot = self.slots.pop(client)
+        self.clients[slot] = None
+        self.active[slot] = False
+        self.free_slots.append(slot)
+
+    def _reset_slot(self, slot):
+        self.delay_sum[slot] = self.period_sum[slot] = 0
+        self.delay_count[slot] = self.period_count[slot] = 0
+        self.last_arrival[slot] = 0
+        for metric in ('delay', 'period'):
+            getattr(self, f'{metric}_samples')[slot] = 0
+            for speed in ('fast', 'slow'):
+                getattr(self, f'{speed}_{metric}_mean')[slot] = 0
+                getattr(self, f'{speed}_{metric}_var')[slot] = 0
+
+    def reset_period(self, slot):
+        # The client was asked to change its interval, so its period baseline
+        # no longer applies. It is rebuilt from scratch, like for a new client
+        self.period_sum[slot] = 0
+        self.period_count[slot] = 0
+        self.period_samples[slot] = 0
+        for speed in ('fast', 'slow'):
+            getattr(self, f'{speed}_period_mean')[slot] = 0
+            getattr(self, f'{speed}_period_var')[slot] = 0
+
+    def record(self, slot, delay_ms, time_recvd):
+        # Runs per heartbeat, so only accumulate here. Statistics are updated
+        # for all clients at once in sweep()
+        self.record_delay(slot, delay_ms)
+
+        last_arrival = self.last_arrival[slot]
+        if last_arrival:
+            self.period_sum[slot] += (time_recvd - last_arrival) * 1000
+            self.period_count[slot] += 1
+        self.last_arrival[slot] = time_recvd
+
+    def record_many(self, slots, delays_ms, time_recvd):
+        # record() for heartbeats from distinct clients received at the same
+        # time, e.g. in one scan of the shared memory table
+        self.delay_sum[slots] += delays_ms
+        self.delay_count[slots] += 1
+
+        last_arrival = self.last_arrival[slots]
+        seen = last_arrival != 0
+        self.period_sum[slots[seen]] += (time_recvd - last_arrival[seen]) * 1000
+        self.period_count[slots[seen]] += 1
+        self.last_arrival[slots] = time_recvd
+
+    def record_delay(self, slot, delay_ms):
+        # For heartbeats queued behind another one in the same packet. They
+        # did not arrive separately, so they have no period of their own
+        self.delay_sum[slot] += delay_ms
+        self.delay_count[slot] += 1
+
+    def _update_ewma(self, speed, metric, alpha, has_sample, sample,
+        update_var, max_diff=None):
+        samples = getattr(self, f'{metric}_samples')
+        mean = getattr(self, f'{speed}_{metric}_mean')
+        var = getattr(self, f'{speed}_{metric}_var')
+
+        diff = np.where(has_sample, sample - mean, 0)
+        # Limits how much a single outlying sample can inflate the variance
+        var_diff = diff if max_diff is None else np.clip(diff, -max_diff,
+            max_diff)
+        np.multiply(var + alpha * np.square(var_diff), 1 - alpha, out=var,
+            where=update_var)
+        np.add(mean, alpha * diff, out=mean)
+
+        # First sample seeds the baseline
+        first = has_sample & (samples == 0)
+        mean[first] = sample[first]
+        var[first] = 0
+
+    def sweep(self, now):
+        # Returns an array of flagged slots and a boolean array per reason in
+        # REASONS, indexed like the flagged slots
+        with np.errstate(divide='ignore', invalid='ignore'):
+            has_delay = self.active & (self.delay_count > 0)
+            delay = self.delay_sum / self.delay_count
+            has_period = self.active & (self.period_count > 0)
+            period = self.period_sum / self.period_count
+
+        self.delay_sum[:] = self.period_sum[:] = 0
+        self.delay_count[:] = self.period_count[:] = 0
+
+        self._update_ewma('fast', 'delay', self.fast_alpha, has_delay, delay,
+            has_delay)
+        self._update_ewma('fast', 'period', self.fast_alpha, has_period,
+            period, has_period)
+
+        # Score recent behaviour against the baseline before it takes in
+        # this sweep's samples
+        delay_std = self._baseline_std('delay')
+        period_std = self._baseline_std('period')
+
+        delay_z = (self.fast_delay_mean - self.slow_delay_mean) / delay_std
+        jitter = self.fast_delay_var / np.square(delay_std)
+        period_z = (self.fast_period_mean - self.slow_period_mean) / period_std
+        silence_ms = (now - self.last_arrival) * 1000
+        silence_z = (silence_ms - self.slow_period_mean) / period_std
+
+        reasons = (
+            delay_z > self.threshold,
+            jitter > self.jitter_ratio,
+            period_z > self.threshold,
+            silence_z > self.threshold,
+        )
+
+        # While a metric is anomalous, its baseline variance is frozen so
+        # that the anomaly does not hide itself. Before that, a drifting
+        # metric is held back by clipping samples to 2 std devs. The baseline
+        # mean keeps moving, so a lasting change of level is eventually
+        # accepted
+        delay_ok = ~(reasons[0] | reasons[1])
+        period_ok = ~reasons[2]
+        self._update_ewma('slow', 'delay', self.slow_alpha, has_delay, delay,
+            has_delay & delay_ok, max_diff=2 * delay_std)
+        self._update_ewma('slow', 'period', self.slow_alpha, has_period,
+            period, has_period & period_ok, max_diff=2 * period_std)
+
+        self.delay_samples += has_delay
+        self.period_samples += has_period
+
+        scored = (self.active & (self.delay_samples >= self.warmup)
+            & (self.period_samples >= self.warmup))
+        flagged = scored & np.logical_or.reduce(reasons)
+
+        slots = np.flatnonzero(flagged)
+        return slots, tuple(reason[slots] for reason in reasons)
+
+    def _baseline_std(self, metric):
+        mean = getattr(self, f'slow_{metric}_mean')
+        var = getattr(self, f'slow_{metric}_var')
+
+        return np.maximum(np.sqrt(var),
+            np.maximum(self.rel_std * np.abs(mean), self.min_std_ms))
+
+    def log_anomalies(self, now):
+        slots, reasons = self.sweep(now)
+
+        for i, slot in enumerate(slots):
+            found = [name for name, flags in zip(REASONS, reasons) if flags[i]]
+            logging.warning(f"Anomaly detected for {self.clients[slot]}: "
+                f"{', '.join(found)} (delay "
+                f"{self.fast_delay_mean[slot]:.4f}ms vs baseline "
+                f"{self.slow_delay_mean[slot]:.4f}ms, period "
+                f"{self.fast_period_mean[slot]:.4f}ms vs baseline "
+                f"{self.slow_period_mean[slot]:.4f}ms)")
+
+        return [self.clients[slot] for slot in slots]
@@ -1,12 +1,24 @@
+import os
 import sys
+import numbers
 import time
 import socket
+import signal
+import select
 import logging
 import argparse
 
 # Local import - Type check helpers
 import helpers
 
+# Local import - Optional, requires POSIX shared memory and file locks
+try:
+    import shm
+except ImportError:
+    shm = None
+
+MAX_PENDING_CONTROL_DATA = 1024
+
 def parse_args():
     parser = argparse.ArgumentParser(description="""Send a 'heartbeat' message
         over a TCP socket at regular intervals""")
@@ -17,8 +29,14 @@ def parse_args():
         type=helpers.check_valid_port,
         help='Destination Port between 0 and 65535, inclusive')
     parser.add_argument('-i', '--interval', default='1000',
-        type=helpers.check_positive_int,
-        help='Interval at which to send heartbeat messages in milliseconds')
+        type=helpers.check_positive_number,
+        help='Interval at which to send heartbeat messages in milliseconds. '
+            'May be fractional, e.g. 0.5 with --shm')
+    parser.add_argument('-g', '--gauges', default=False, action='store_true',
+        help='Report system load average with each heartbeat')
+    parser.add_argument('--shm', default=None,
+        help='Write heartbeats to the shared memory table with this name '
+            'instead of connecting over TCP (server must run on this host)')
 
     return parser.parse_args()
 
@@ -34,8 +52,41 @@ def establish_connection(socket, host, port):
             f"\nError: {str(e)}")
         sys.exit(1)
 
-def send_heartbeat(socket, sequence_num):
+def encode_gauges(gauges, last_gauges):
+    # Only gauges that changed since they were last sent are included.
+    # Expected format: "key=value,key=value"
+    changed = []
+    for key, value in gauges.items():
+        if not key.isidentifier():
+            raise ValueError(f"Gauge name {key} is not a valid identifier")
+
+        # Gauges must be numeric. Booleans are ints, but would be sent as
+        # True/False, which the server cannot decode
+        if not isinstance(value, numbers.Real) or isinstance(value, bool):
+            raise ValueError(f"Gauge {key} value {value!r} is not a number")
+
+        if last_gauges.get(key) != value:
+            changed.append(f"{key}={value}")
+
+    return ','.join(changed)
+
+def collect_system_gauges():
+    try:
+        load_1m, load_5m, load_15m = os.getloadavg()
+    except (AttributeError, OSError):  # Not available on all platforms
+        return {}
+
+    return {'load_1m': round(load_1m, 2)}
+
+def format_heartbeat(sequence_num, payload=''):
     data = (f"Sequence #{sequence_num}: Sending heartbeat at {time.time():.4f}. ")
+    if payload:
+        data += f"Gauges {payload}. "
+
+    return data
+
+def send_heartbeat(socket, sequence_num, payload=''):
+    data = format_heartbeat(sequence_num, payload)
     logging.info(data)
 
     try:
@@ -45,12 +96,101 @@ def send_heartbeat(socket, sequence_num):
             f"Server may have abruptly closed. \n Error: {str(e)}")
         sys.exit(1)
 
-def start_heartbeat_loop(socket, interval):
+def get_interval(data):
+    # Expected format: "Interval: {interval_ms}. " (one or more control messages)
+    # Only the most recent complete control message is relevant
+    data, _ = helpers.split_complete_messages(data)
+    start = data.rfind('Interval: ')
+    if start == -1:
+        return None
+
+    end = data.find('. ', start)
+    if end == -1:
+        return None
+
+    return int(data[start + len('Interval: ') : end])
+
+def check_interval_update(socket, interval, pending=''):
+    # Non-blocking check for a control message sent by the server. A control
+    # message may be split across reads, so the unterminated rest is returned
+    # to be passed back in as pending with the next call
+    try:
+        readable, _, _ = select.select([socket], [], [], 0)
+        if not readable:
+            return interval, pending
+
+        data, pending = helpers.split_complete_messages(pending
+            + socket.recv(1024).decode('utf-8'))
+        if len(pending) > MAX_PENDING_CONTROL_DATA:
+            pending = ''  # Not a control message
+
+        new_interval = get_interval(data)
+    except (OSError, ValueError) as e:
+        # Send failures are handled by send_heartbeat()
+        logging.debug(f"Failed to read control message. Error: {str(e)}")
+        return interval, pending
+
+    if new_interval is None or new_interval <= 0:
+        return interval, pending
+
+    if new_interval != interval:
+        logging.info(f"Server changed heartbeat interval from {interval}ms "
+            f"to {new_interval}ms")
+
+    return new_interval, pending
+
+def start_heartbeat_loop(socket, interval, collect_gauges=None):
     sequence_num = 0
+    last_gauges = {}  # Gauges known to the server over this connection
+    pending = ''  # Partial control message from the server
 
     while True:
         sequence_num += 1
-        send_heartbeat(socket, sequence_num)
+
+        if collect_gauges is None:
+            send_heartbeat(socket, sequence_num)
+        else:
+            gauges = collect_gauges()
+            send_heartbeat(socket, sequence_num,
+                encode_gauges(gauges, last_gauges))
+            last_gauges.update(gauges)
+
+        # Server may ask to change the interval at runtime
+        interval, pending = check_interval_update(socket, interval, pending)
+
+        time.sleep(interval / 1000)  # Convert interval to seconds
+
+def attach_shm_writer(name):
+    if shm is None:
+        logging.error("Shared memory transport is not supported on this "
+            "platform")
+        sys.exit(1)
+
+    try:
+        writer = shm.ShmHeartbeatWriter(name)
+    except FileNotFoundError as e:
+        logging.error(f"Failed to attach to shared memory table {name}. "
+            "Please make sure server is running with --shm."
+            f"\nError: {str(e)}")
+        sys.exit(1)
+    except RuntimeError as e:
+        logging.error(f"Failed to claim a shared memory slot. Error: {str(e)}")
+        sys.exit(1)
+
+    logging.info(f"Attached to shared memory table {name} in slot "
+        f"{writer.slot}")
+    return writer
+
+def start_shm_heartbeat_loop(writer, interval):
+    sequence_num = 0
+
+    while True:
+        sequence_num += 1
+        time_sent = writer.beat(sequence_num)
+        # Writing to stderr on every beat would cost a syscall, which the
+        # shared memory transport avoids
+        logging.debug(f"Sequence #{sequence_num}: Writing heartbeat at "
+            f"{time_sent:.4f}. ")
 
         time.sleep(interval / 1000)  # Convert interval to seconds
 
@@ -58,7 +198,18 @@ if __name__ == '__main__':
     args = parse_args()
     logging.basicConfig(level=logging.INFO)
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        establish_connection(s, args.host, args.port)
+    # Exit through SystemExit, so that the shared memory slot is freed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    if args.shm:
+        writer = attach_shm_writer(args.shm)
+        try:
+            start_shm_heartbeat_loop(writer, args.interval)
+        finally:
+            writer.close()  # Free the slot for other clients
+    else:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            establish_connection(s, args.host, args.port)
 
-        start_heartbeat_loop(s, args.interval)
+            collect_gauges = collect_system_gauges if args.gauges else None
+            start_heartbeat_loop(s, args.interval, collect_gauges)
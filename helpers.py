@@ -10,6 +10,21 @@ def check_positive_int(arg):
     except ValueError:
         raise argparse.ArgumentTypeError(f"{arg} is not an integer")
 
+def check_positive_number(arg):
+    # Integers are kept as such, fractions are allowed
+    try:
+        val = int(arg)
+    except ValueError:
+        try:
+            val = float(arg)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"{arg} is not a number")
+
+    if not 0 < val < float('inf'):
+        raise argparse.ArgumentTypeError(f"{val} is not a positive number")
+
+    return val
+
 def check_valid_port(arg):
     try:
         val = int(arg)
@@ -20,3 +35,34 @@ def check_valid_port(arg):
         return val
     except ValueError:
         raise argparse.ArgumentTypeError(f"{arg} is not an integer")
+
+def substr_index_data_start(string, substr):
+    index = string.find(substr)
+
+    if index == -1:
+        raise Exception(f"Substring {substr} not found in string {string}")
+
+    return index + len(substr)  # Data starts after substr passed in
+
+def get_seq_num(data):
+    # Expected format: "Sequence #{seq_num}: Sending heartbeat at {timestamp}. "
+    start = substr_index_data_start(data, '#')
+    seq_num = data[start : data.find(':', start)]
+    return int(seq_num)
+
+def get_timestamp(data):
+    # Expected format: "Sequence #{seq_num}: Sending heartbeat at {timestamp}. "
+    start = substr_index_data_start(data, ' at ')
+    timestamp = data[start : data.find('. ', start)]
+    return float(timestamp)
+
+def split_complete_messages(data):
+    # Messages end with '. ' but may be split across reads. Returns the
+    # complete messages and the unterminated rest, to be prepended to the next
+    # read
+    end = data.rfind('. ')
+    if end == -1:
+        return '', data
+
+    end += len('. ')
+    return data[:end], data[end:]
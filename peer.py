@@ -0,0 +1,623 @@
+import sys
+import math
+import time
+import random
+import socket
+import logging
+import argparse
+import selectors
+import threading
+
+# Local import - Type check helpers and heartbeat message parsing
+import helpers
+
+# Local import - Heartbeat message format
+import client
+
+# SWIM-style peer-to-peer membership built on the heartbeat message format.
+#
+# Every protocol period, each node pings one member (round-robin over a
+# shuffled list). If no ack arrives in time, it asks a few other members to
+# ping the target on its behalf (PingReq). If none of them gets an ack
+# either, the target is suspected, and declared dead if it does not refute
+# the suspicion in time. Membership updates are piggybacked on pings and acks,
+# a bounded number per message and a bounded number of times each, so the
+# network and CPU cost per node and period stays constant as the cluster
+# grows.
+#
+# Messages are heartbeats with extra sections, sent over UDP:
+#   "Sequence #{seq}: Sending heartbeat at {timestamp}. Ping from {node}. "
+#   "Members {node}={status}/{incarnation},... "
+#
+# Nodes are named "{ip}:{port}".
+
+ALIVE = 'alive'
+SUSPECT = 'suspect'
+DEAD = 'dead'
+
+# Message kinds, each followed by the sending node
+PING = 'Ping'
+ACK = 'Ack'
+PING_REQ = 'PingReq'
+JOIN = 'Join'
+SYNC = 'Sync'
+KINDS = (PING_REQ, PING, ACK, JOIN, SYNC)
+
+MAX_DATAGRAM_SIZE = 1400  # Stay within a typical MTU
+SYNC_MEMBERS_PER_MESSAGE = 32
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="""Run a peer that tracks
+        cluster membership using SWIM-style heartbeats""")
+
+    parser.add_argument('-ho', '--host', default='localhost',
+        help='Host IP to bind to')
+    parser.add_argument('-p', '--port', default='6520',
+        type=helpers.check_valid_port,
+        help='Port to bind to between 0 and 65535, inclusive')
+    parser.add_argument('-j', '--join', default=[], action='append',
+        help='host:port of a peer to join through. May be repeated')
+    parser.add_argument('-i', '--interval', default='1000',
+        type=helpers.check_positive_int,
+        help='Protocol period in milliseconds')
+    parser.add_argument('-s', '--simulate', default=None,
+        type=helpers.check_positive_int,
+        help='Run this many peers on loopback and report convergence time and '
+            'message load instead')
+
+    return parser.parse_args()
+
+## Message format
+
+def node_name(host, port):
+    return f"{socket.gethostbyname(host)}:{port}"
+
+def node_addr(node):
+    host, port = node.rsplit(':', 1)
+    return host, int(port)
+
+def get_section(data, prefix):
+    # Returns the text between prefix and the next '. ', or None
+    start = data.find(prefix)
+    if start == -1:
+        return None
+
+    start += len(prefix)
+    end = data.find('. ', start)
+    if end == -1:
+        raise ValueError(f"Section {prefix.strip()} is incomplete")
+
+    return data[start:end]
+
+def format_members(updates):
+    return ','.join(f"{node}={status}/{incarnation}"
+        for node, status, incarnation in updates)
+
+def parse_members(section):
+    updates = []
+    if not section:
+        return updates
+
+    for entry in section.split(','):
+        node, state = entry.split('=')
+        status, incarnation = state.split('/')
+        if status not in (ALIVE, SUSPECT, DEAD):
+            raise ValueError(f"Unknown member status {status}")
+        updates.append((node, status, int(incarnation)))
+
+    return updates
+
+def format_message(seq_num, kind, sender, target=None, updates=()):
+    data = client.format_heartbeat(seq_num)
+    data += f"{kind} from {sender}"
+    if target is not None:
+        data += f" for {target}"
+    data += ". "
+
+    if updates:
+        data += f"Members {format_members(updates)}. "
+
+    return data
+
+def parse_message(data):
+    # Returns (seq_num, timestamp, kind, sender, target, updates)
+    seq_num = helpers.get_seq_num(data)
+    time_sent = helpers.get_timestamp(data)
+
+    for kind in KINDS:
+        section = get_section(data, f"{kind} from ")
+        if section is not None:
+            break
+    else:
+        raise ValueError("Unknown message kind")
+
+    sender, _, target = section.partition(' for ')
+    updates = parse_members(get_section(data, 'Members '))
+
+    return seq_num, time_sent, kind, sender, target or None, updates
+
+## Message format - End
+
+## Membership rules
+
+def overrides(update, member):
+    # Whether an update (status, incarnation) replaces what is known about a
+    # member, following SWIM's precedence rules
+    status, incarnation = update
+    if member is None:
+        return True
+
+    known_status, known_incarnation = member
+
+    if status == ALIVE:
+        return incarnation > known_incarnation
+    if status == SUSPECT:
+        if known_status == DEAD:
+            return False
+        if known_status == ALIVE:
+            return incarnation >= known_incarnation
+        return incarnation > known_incarnation
+
+    # Dead is final for that incarnation. The node must rejoin with a higher
+    # one to be considered alive again
+    return known_status != DEAD
+
+def scaled_limit(multiplier, n_members):
+    # Suspicion timeouts and retransmissions grow with log(cluster size), the
+    # number of periods needed for gossip to reach every member
+    return multiplier * max(1, math.ceil(math.log10(n_members + 1)))
+
+## Membership rules - End
+
+
+class PeerNode:
+    def __init__(self, host='localhost', port=0, seeds=(), interval=1000,
+        indirect_probes=3, suspicion_mult=4, retransmit_mult=4,
+        retention_mult=8, max_piggyback=8, on_change=None):
+        self.host = host
+        self.port = port
+        self.seeds = list(seeds)  # host:port of peers to join through
+        self.interval = interval  # Protocol period in milliseconds
+        self.indirect_probes = indirect_probes
+        self.suspicion_mult = suspicion_mult
+        self.retransmit_mult = retransmit_mult
+        self.retention_mult = retention_mult
+        self.max_piggyback = max_piggyback
+        # Called on the node's thread as on_change(peer, node, status)
+        self.on_change = on_change
+
+        self.name = None
+        self.incarnation = 0
+        self.members = {}  # Node -> (status, incarnation), excluding self
+
+        # Message load
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.bytes_sent = 0
+        self.periods = 0
+
+        self._sock = None
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()  # Guards members for snapshots
+
+        self._seq_num = 0
+        self._probe = None  # Current probe: target, seq, deadline, acked
+        self._probe_order = []
+        self._relays = {}  # Own seq -> (origin, origin seq, deadline)
+        self._suspicions = {}  # Node -> (incarnation, deadline)
+        self._dead = {}  # Node -> deadline to forget it
+        self._gossip = {}  # Node -> times sent
+        self._gossip_queues = [{}]  # Times sent -> {node: update}, oldest first
+
+    ## Public API
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((self.host, self.port))
+        self._sock.setblocking(False)
+        self.name = node_name(*self._sock.getsockname())
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+            name=f"Peer {self.name}", daemon=True)
+        self._thread.start()
+
+        return self.name
+
+    def stop(self, timeout=None):
+        # Leaves abruptly, like a crashed node
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def alive_members(self):
+        with self._lock:
+            return {node for node, (status, _) in self.members.items()
+                if status != DEAD}
+
+    def member_status(self, node):
+        with self._lock:
+            member = self.members.get(node)
+
+        return member[0] if member else None
+
+    @property
+    def messages_per_period(self):
+        if not self.periods:
+            return 0.0
+
+        return (self.messages_sent + self.messages_received) / self.periods
+
+    ## Node thread only
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._sock, selectors.EVENT_READ)
+
+        # Announce ourselves through the seeds, and learn the membership
+        self._queue_gossip(self.name, ALIVE, self.incarnation)
+        for seed in self.seeds:
+            self._send(node_name(*node_addr(seed)), JOIN, self._next_seq())
+
+        period_s = self.interval / 1000
+        next_period = time.monotonic()
+
+        try:
+            while self._running:
+                now = time.monotonic()
+                if now >= next_period:
+                    self._start_period(now)
+                    next_period += period_s
+                    if next_period < now:  # Fell behind, e.g. suspended
+                        next_period = now + period_s
+
+                self._check_timeouts(now)
+
+                # Wake up at least every tenth of a period for timeouts
+                timeout = max(0, min(next_period - now, period_s / 10))
+                if selector.select(timeout):
+                    self._receive_all()
+        finally:
+            selector.close()
+            self._sock.close()
+
+    def _next_seq(self):
+        self._seq_num += 1
+        return self._seq_num
+
+    def _start_period(self, now):
+        self.periods += 1
+
+        # Previous probe got no direct or indirect ack within its period
+        probe = self._probe
+        if probe is not None and not probe['acked']:
+            member = self.members.get(probe['target'])
+            if member is not None and member[0] == ALIVE:
+                logging.debug(f"{self.name}: no ack from {probe['target']}")
+                self._apply(probe['target'], SUSPECT, member[1])
+
+        target = self._next_probe_target()
+        if target is None:
+            self._probe = None
+            return
+
+        seq_num = self._next_seq()
+        self._probe = {'target': target, 'seq': seq_num, 'acked': False,
+            'indirect': False, 'deadline': now + self.interval / 1000 / 3}
+        self._send(target, PING, seq_num)
+
+    def _next_probe_target(self):
+        while self._probe_order:
+            node = self._probe_order.pop()
+            member = self.members.get(node)
+            if member is not None and member[0] != DEAD:
+                return node
+
+        candidates = [node for node, (status, _) in self.members.items()
+            if status != DEAD]
+        if not candidates:
+            return None
+
+        random.shuffle(candidates)
+        self._probe_order = candidates
+        return self._probe_order.pop()
+
+    def _check_timeouts(self, now):
+        probe = self._probe
+        if (probe is not None and not probe['acked'] and not probe['indirect']
+            and now >= probe['deadline']):
+            # Ask others to probe the target, in case the problem is between
+            # us and the target only
+            probe['indirect'] = True
+            proxies = [node for node, (status, _) in self.members.items()
+                if status == ALIVE and node != probe['target']]
+            for node in random.sample(proxies,
+                min(self.indirect_probes, len(proxies))):
+                self._send(node, PING_REQ, probe['seq'], probe['target'])
+
+        # Dead members are kept long enough for the news to spread and for
+        # stale suspicions to be ignored, then forgotten so that the member
+        # list does not grow with every node that ever left
+        for node, deadline in list(self._dead.items()):
+            if now >= deadline:
+                del self._dead[node]
+                with self._lock:
+                    del self.members[node]
+
+        for node, (incarnation, deadline) in list(self._suspicions.items()):
+            if now >= deadline:
+                del self._suspicions[node]
+                self._apply(node, DEAD, incarnation)
+
+        for seq_num, (_, _, deadline) in list(self._relays.items()):
+            if now >= deadline:
+                del self._relays[seq_num]
+
+    def _receive_all(self):
+        while True:
+            try:
+                data, addr = self._sock.recvfrom(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:  # e.g. ICMP port unreachable
+                logging.debug(f"{self.name}: receive failed. Error: {str(e)}")
+                continue
+
+            self.messages_received += 1
+            try:
+                self._handle(data.decode('utf-8'))
+            except Exception as e:
+                logging.warning(f"{self.name}: failed to parse message {data}."
+                    f"\nError: {str(e)}")
+
+    def _handle(self, data):
+        seq_num, time_sent, kind, sender, target, updates = parse_message(data)
+
+        # The full member list sent to a joining node is not news to the rest
+        # of the cluster, so it is not gossiped further
+        for node, status, incarnation in updates:
+            self._apply(node, status, incarnation, gossip=kind != SYNC)
+
+        # Any message is proof the sender is up, as far as we know about it
+        member = self.members.get(sender)
+        if sender != self.name and member is None:
+            self._apply(sender, ALIVE, 0)
+        elif member is not None and member[0] == DEAD:
+            # Restarted after being declared dead. Tell it, so that it rejoins
+            # with a higher incarnation
+            self._queue_gossip(sender, DEAD, member[1])
+
+        if kind == PING:
+            self._send(sender, ACK, seq_num)
+        elif kind == ACK:
+            self._handle_ack(seq_num, sender)
+        elif kind == PING_REQ:
+            relay_seq = self._next_seq()
+            self._relays[relay_seq] = (sender, seq_num,
+                time.monotonic() + self.interval / 1000)
+            self._send(target, PING, relay_seq)
+        elif kind == JOIN:
+            self._send_sync(sender, seq_num)
+
+    def _handle_ack(self, seq_num, sender):
+        probe = self._probe
+        if probe is not None and probe['seq'] == seq_num \
+            and probe['target'] == sender:
+            probe['acked'] = True
+            return
+
+        relay = self._relays.pop(seq_num, None)
+        if relay is not None:
+            # Forward the target's ack to the node that asked for it
+            origin, origin_seq, deadline = relay
+            self._send(origin, ACK, origin_seq, sender=sender)
+
+    def _send_sync(self, node, seq_num):
+        # Full membership, only sent to joining nodes. Includes what is known
+        # about the joining node itself: if it was declared dead before a
+        # restart, it refutes that with a higher incarnation
+        updates = [(self.name, ALIVE, self.incarnation)]
+        updates += [(member, status, incarnation) for member,
+            (status, incarnation) in self.members.items()]
+
+        for start in range(0, len(updates), SYNC_MEMBERS_PER_MESSAGE):
+            self._send(node, SYNC, seq_num,
+                updates=updates[start : start + SYNC_MEMBERS_PER_MESSAGE])
+
+    def _apply(self, node, status, incarnation, gossip=True):
+        if node == self.name:
+            if status != ALIVE and incarnation >= self.incarnation:
+                # Refute, so the rest of the cluster stops suspecting us
+                self.incarnation = incarnation + 1
+                self._queue_gossip(self.name, ALIVE, self.incarnation)
+            return
+
+        member = self.members.get(node)
+        if not overrides((status, incarnation), member):
+            return
+
+        with self._lock:
+            self.members[node] = (status, incarnation)
+
+        if status == SUSPECT:
+            if node not in self._suspicions:
+                timeout_s = scaled_limit(self.suspicion_mult,
+                    len(self.members)) * self.interval / 1000
+                self._suspicions[node] = (incarnation,
+                    time.monotonic() + timeout_s)
+        else:
+            self._suspicions.pop(node, None)
+
+        if status == DEAD:
+            retention_s = scaled_limit(self.retention_mult,
+                len(self.members)) * self.interval / 1000
+            self._dead[node] = time.monotonic() + retention_s
+        else:
+            self._dead.pop(node, None)
+
+        if member is None or member[0] != status:
+            logging.info(f"{self.name}: {node} is {status}")
+            if self.on_change is not None:
+                try:
+                    self.on_change(self, node, status)
+                except Exception:
+                    logging.exception("Peer membership callback failed")
+
+        if gossip:
+            self._queue_gossip(node, status, incarnation)
+
+    def _queue_gossip(self, node, status, incarnation):
+        # Replaces any older update about the same node
+        times_sent = self._gossip.get(node)
+        if times_sent is not None:
+            del self._gossip_queues[times_sent][node]
+
+        self._gossip[node] = 0
+        self._gossip_queues[0][node] = (node, status, incarnation)
+
+    def _piggyback(self, budget):
+        # Least gossiped updates first, so new ones spread quickly. Updates are
+        # bucketed by times sent, so the cost per message depends on the
+        # retransmit limit and max_piggyback, not on the cluster size
+        limit = scaled_limit(self.retransmit_mult, len(self.members))
+
+        picked = []
+        full = False
+        for times_sent, queue in enumerate(self._gossip_queues):
+            for node, update in queue.items():
+                size = len(format_members([update])) + 1
+                if len(picked) == self.max_piggyback or size > budget:
+                    full = True
+                    break
+                budget -= size
+                picked.append((times_sent, node, update))
+
+            if full:
+                break
+
+        for times_sent, node, update in picked:
+            del self._gossip_queues[times_sent][node]
+            times_sent += 1
+            if times_sent >= limit:
+                del self._gossip[node]
+                continue
+
+            if times_sent == len(self._gossip_queues):
+                self._gossip_queues.append({})
+            self._gossip_queues[times_sent][node] = update
+            self._gossip[node] = times_sent
+
+        return [update for _, _, update in picked]
+
+    def _send(self, node, kind, seq_num, target=None, sender=None,
+        updates=None):
+        if updates is None:
+            header = format_message(seq_num, kind, sender or self.name, target)
+            updates = self._piggyback(MAX_DATAGRAM_SIZE - len(header) - 16)
+
+        data = format_message(seq_num, kind, sender or self.name, target,
+            updates).encode('utf-8')
+
+        try:
+            self._sock.sendto(data, node_addr(node))
+        except OSError as e:
+            logging.debug(f"{self.name}: failed to send to {node}. "
+                f"Error: {str(e)}")
+            return
+
+        self.messages_sent += 1
+        self.bytes_sent += len(data)
+
+
+## Loopback simulation
+
+def wait_until(condition, timeout_s, poll_s=0.01):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout_s:
+        if condition():
+            return time.monotonic() - start
+        time.sleep(poll_s)
+
+    return None
+
+def simulate(n_nodes, interval=100, timeout_s=60):
+    # Starts n_nodes peers on loopback, all joining through the first one.
+    # Measures how long the cluster takes to converge, then stops one node and
+    # measures how long it takes for every other node to declare it dead
+    first = PeerNode(interval=interval)
+    nodes = [first]
+    first.start()
+    nodes += [PeerNode(seeds=[first.name], interval=interval)
+        for _ in range(n_nodes - 1)]
+    for node in nodes[1:]:
+        node.start()
+
+    names = {node.name for node in nodes}
+    report = {'nodes': n_nodes, 'interval_ms': interval}
+
+    try:
+        report['join_s'] = wait_until(lambda: all(
+            node.alive_members() == names - {node.name} for node in nodes),
+            timeout_s)
+
+        periods_before = {node.name: node.periods for node in nodes}
+        messages_before = {node.name: node.messages_sent
+            + node.messages_received for node in nodes}
+
+        victim = nodes.pop(random.randrange(1, len(nodes)))
+        victim.stop()
+
+        report['detect_s'] = wait_until(lambda: all(
+            victim.name not in node.alive_members() for node in nodes),
+            timeout_s)
+
+        # Steady-state load, excluding the join burst
+        loads = []
+        for node in nodes:
+            periods = node.periods - periods_before[node.name]
+            messages = (node.messages_sent + node.messages_received
+                - messages_before[node.name])
+            if periods:
+                loads.append(messages / periods)
+
+        report['messages_per_period_mean'] = sum(loads) / len(loads)
+        report['messages_per_period_max'] = max(loads)
+    finally:
+        for node in nodes:
+            node.stop()
+
+    return report
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.simulate:
+        logging.getLogger().setLevel(logging.WARNING)
+        report = simulate(args.simulate, args.interval)
+
+        print(f"Nodes: {report['nodes']}, protocol period: "
+            f"{report['interval_ms']}ms")
+        for key, label in (('join_s', 'Membership converged'),
+            ('detect_s', 'Failed node declared dead by all')):
+            value = report[key]
+            print(f"{label}: " + (f"{value:.2f}s" if value is not None
+                else "timed out"))
+        print("Messages per node per period: "
+            f"{report['messages_per_period_mean']:.2f} mean, "
+            f"{report['messages_per_period_max']:.2f} max")
+        sys.exit(0)
+
+    node = PeerNode(args.host, args.port, args.join, args.interval)
+    try:
+        name = node.start()
+    except OSError as e:
+        logging.error(f"Failed to bind port {args.port}. Error: {str(e)}")
+        sys.exit(1)
+
+    logging.info(f"Peer {name} running")
+    while True:
+        time.sleep(1)
@@ -0,0 +1,244 @@
+import json
+import socket
+import logging
+import threading
+
+from array import array
+from collections import OrderedDict
+
+# Rolling time-series rollups of heartbeat delay per client.
+#
+# Each client has one fixed-size ring buffer per resolution. A bucket holds
+# the count, missed count, min/max/sum of delays and a log-scale histogram of
+# delays (for p99) over one period. Buckets are overwritten once they are
+# older than the ring, so memory per client is fixed upfront (see
+# Rollups.bytes_per_client).
+
+RESOLUTIONS = (('second', 1), ('minute', 60), ('hour', 3600))
+
+# Histogram bin i holds delays in [BASE * RATIO^i, BASE * RATIO^(i+1)), with
+# anything lower in the first bin and anything higher in the last one.
+# 48 bins cover 0.01ms to ~650ms with a ~26% bin width
+HISTOGRAM_BINS = 48
+HISTOGRAM_BASE_MS = 0.01
+HISTOGRAM_RATIO = 2 ** (1 / 3)
+
+# Upper edge of each bin
+HISTOGRAM_EDGES = [HISTOGRAM_BASE_MS * HISTOGRAM_RATIO ** (i + 1)
+    for i in range(HISTOGRAM_BINS)]
+
+
+def histogram_bin(delay_ms):
+    # Binary search, as this runs three times per heartbeat
+    low, high = 0, HISTOGRAM_BINS - 1
+    while low < high:
+        mid = (low + high) // 2
+        if delay_ms < HISTOGRAM_EDGES[mid]:
+            high = mid
+        else:
+            low = mid + 1
+
+    return low
+
+
+class RingBuffer:
+    def __init__(self, period_s, size):
+        self.period_s = period_s
+        self.size = size
+
+        self.epochs = array('q', [-1]) * size  # Period index held by bucket
+        self.counts = array('I', [0]) * size
+        self.missed = array('I', [0]) * size
+        self.mins = array('d', [0.0]) * size
+        self.maxs = array('d', [0.0]) * size
+        self.sums = array('d', [0.0]) * size
+        self.histograms = array('I', [0]) * (size * HISTOGRAM_BINS)
+
+    @classmethod
+    def bytes_per_bucket(cls):
+        return (array('q').itemsize + 2 * array('I').itemsize
+            + 3 * array('d').itemsize + HISTOGRAM_BINS * array('I').itemsize)
+
+    def _bucket(self, timestamp):
+        epoch = int(timestamp // self.period_s)
+        slot = epoch % self.size
+
+        if self.epochs[slot] != epoch:  # Bucket is reused for a new period
+            self.epochs[slot] = epoch
+            self.counts[slot] = self.missed[slot] = 0
+            self.mins[slot] = self.maxs[slot] = self.sums[slot] = 0.0
+            start = slot * HISTOGRAM_BINS
+            self.histograms[start : start + HISTOGRAM_BINS] = \
+                array('I', [0]) * HISTOGRAM_BINS
+
+        return slot
+
+    def record(self, timestamp, delay_ms, missed=0, hist_bin=None):
+        slot = self._bucket(timestamp)
+
+        if self.counts[slot] == 0:
+            self.mins[slot] = self.maxs[slot] = delay_ms
+        elif delay_ms < self.mins[slot]:
+            self.mins[slot] = delay_ms
+        elif delay_ms > self.maxs[slot]:
+            self.maxs[slot] = delay_ms
+
+        self.counts[slot] += 1
+        self.missed[slot] += missed
+        self.sums[slot] += delay_ms
+
+        if hist_bin is None:
+            hist_bin = histogram_bin(delay_ms)
+        self.histograms[slot * HISTOGRAM_BINS + hist_bin] += 1
+
+    def _percentile(self, slot, fraction):
+        target = fraction * self.counts[slot]
+        start = slot * HISTOGRAM_BINS
+
+        # The last bin has no upper edge, so a percentile falling into it is
+        # only bounded by the maximum
+        cumulative = 0
+        for i in range(HISTOGRAM_BINS - 1):
+            cumulative += self.histograms[start + i]
+            if cumulative >= target:
+                # Upper edge of the bin, within the observed range
+                return min(max(HISTOGRAM_EDGES[i], self.mins[slot]),
+                    self.maxs[slot])
+
+        return self.maxs[slot]
+
+    def query(self, start=None, end=None):
+        # Buckets overlapping [start, end), oldest first
+        buckets = []
+
+        for slot in range(self.size):
+            epoch = self.epochs[slot]
+            if epoch < 0 or self.counts[slot] == 0:
+                continue
+
+            bucket_start = epoch * self.period_s
+            if start is not None and bucket_start + self.period_s <= start:
+                continue
+            if end is not None and bucket_start >= end:
+                continue
+
+            count = self.counts[slot]
+            buckets.append({
+                'start': bucket_start,
+                'count': count,
+                'missed': self.missed[slot],
+                'min_ms': self.mins[slot],
+                'mean_ms': self.sums[slot] / count,
+                'max_ms': self.maxs[slot],
+                'p99_ms': self._percentile(slot, 0.99),
+            })
+
+        buckets.sort(key=lambda bucket: bucket['start'])
+        return buckets
+
+
+class Rollups:
+    def __init__(self, seconds=60, minutes=60, hours=24, max_clients=1024):
+        # Ring sizes per resolution, e.g. 60 per-minute buckets cover an hour
+        self.sizes = {'second': seconds, 'minute': minutes, 'hour': hours}
+        self.max_clients = max_clients  # Least recently seen are evicted
+
+        self._clients = OrderedDict()  # Client -> {resolution: RingBuffer}
+        self._lock = threading.Lock()  # Recorded and queried from threads
+
+    @property
+    def bytes_per_client(self):
+        return sum(self.sizes.values()) * RingBuffer.bytes_per_bucket()
+
+    @property
+    def max_bytes(self):
+        return self.max_clients * self.bytes_per_client
+
+    def _rings(self, client):
+        rings = self._clients.get(client)
+        if rings is None:
+            if len(self._clients) >= self.max_clients:
+                evicted, _ = self._clients.popitem(last=False)
+                logging.debug(f"Evicted rollups for {evicted}")
+
+            rings = {name: RingBuffer(period_s, self.sizes[name])
+                for name, period_s in RESOLUTIONS}
+            self._clients[client] = rings
+        else:
+            self._clients.move_to_end(client)
+
+        return rings
+
+    def record(self, client, timestamp, delay_ms, missed=0):
+        hist_bin = histogram_bin(delay_ms)
+
+        with self._lock:
+            for ring in self._rings(client).values():
+                ring.record(timestamp, delay_ms, missed, hist_bin)
+
+    def clients(self):
+        with self._lock:
+            return list(self._clients)
+
+    def query(self, clients=None, resolution='minute', start=None, end=None):
+        # Returns {client: [bucket, ...]} for the given clients (default all)
+        if resolution not in self.sizes:
+            raise ValueError(f"Unknown resolution {resolution}. Expected one "
+                f"of {', '.join(self.sizes)}")
+
+        with self._lock:
+            if clients is None:
+                clients = list(self._clients)
+
+            return {client: self._clients[client][resolution].query(start, end)
+                for client in clients if client in self._clients}
+
+
+## Local query interface
+
+def handle_query(rollups, request):
+    # Expected format: {"clients": [...], "resolution": "minute",
+    #   "start": <unix time>, "end": <unix time>}, all fields optional
+    try:
+        query = json.loads(request)
+        if not isinstance(query, dict):
+            raise ValueError("Query must be a JSON object")
+
+        clients = query.get('clients')
+        if isinstance(clients, str):  # Single client
+            clients = [clients]
+
+        result = rollups.query(clients,
+            query.get('resolution', 'minute'), query.get('start'),
+            query.get('end'))
+    except (ValueError, TypeError) as e:
+        return json.dumps({'error': str(e)})
+
+    return json.dumps(result)
+
+def serve_queries(rollups, port):
+    # One JSON query per line, one JSON response per line. Local only
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(('localhost', port))
+        except OSError as e:
+            logging.error(f"Failed to serve rollup queries on port {port}. "
+                f"Error: {str(e)}")
+            return
+
+        s.listen(8)
+        logging.info(f"Serving rollup queries on port {port}")
+
+        while True:
+            connection, client_addr = s.accept()
+            with connection:
+                try:
+                    connection.settimeout(5)
+                    with connection.makefile('rw', encoding='utf-8') as f:
+                        for request in f:
+                            f.write(handle_query(rollups, request) + '\n')
+                            f.flush()
+                except (OSError, UnicodeDecodeError) as e:
+                    logging.warning(f"Failed to answer rollup query from "
+                        f"{client_addr}. Error: {str(e)}")
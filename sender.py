@@ -0,0 +1,423 @@
+import time
+import heapq
+import socket
+import logging
+import selectors
+import threading
+
+# Local import - Message framing
+import helpers
+
+# Local import - Heartbeat message format
+import client
+
+# Embeddable heartbeat sender.
+#
+# Unlike client.py, nothing here blocks the caller or exits the process. All
+# sockets are non-blocking and serviced by a single background thread
+# (SenderLoop), which can multiplex any number of HeartbeatSenders. Errors are
+# reported through the on_disconnect callback and followed by a reconnect.
+
+CONNECT_TIMEOUT_S = 5.0
+RECONNECT_INTERVAL_S = 1.0
+MAX_RECONNECT_INTERVAL_S = 30.0
+
+# Connection states
+DISCONNECTED = 'disconnected'
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+STOPPED = 'stopped'
+
+
+class SenderLoop:
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._timers = []  # Heap of (due time, sender id, sender)
+        self._calls = []  # Calls queued by other threads
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+        # Used to wake up select() when a call is queued
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+
+    def call_soon(self, callback, *args):
+        # Thread-safe. The callback runs on the loop thread
+        with self._lock:
+            if self._closed:
+                return
+
+            self._calls.append((callback, args))
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                    name='HeartbeatSenderLoop', daemon=True)
+                self._thread.start()
+
+        try:
+            self._wakeup_send.send(b'\0')
+        except BlockingIOError:
+            pass  # Loop already has a pending wakeup
+
+    def close(self, timeout=None):
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+
+        try:
+            self._wakeup_send.send(b'\0')
+        except BlockingIOError:
+            pass
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    ## Loop thread only
+
+    def schedule(self, sender, due):
+        sender._due = due
+        heapq.heappush(self._timers, (due, id(sender), sender))
+
+    def register(self, sock, events, sender):
+        try:
+            self._selector.modify(sock, events, sender)
+        except KeyError:
+            self._selector.register(sock, events, sender)
+
+    def unregister(self, sock):
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def _run(self):
+        while True:
+            with self._lock:
+                calls, self._calls = self._calls, []
+                closed = self._closed
+
+            if closed:
+                break
+
+            for callback, args in calls:
+                self._guard(callback, *args)
+
+            self._run_timers()
+
+            timeout = None
+            if self._timers:
+                timeout = max(0, self._timers[0][0] - time.monotonic())
+
+            for key, mask in self._selector.select(timeout):
+                if key.fileobj is self._wakeup_recv:
+                    self._drain_wakeup()
+                else:
+                    self._guard(key.data._handle_event, mask)
+
+        self._shutdown()
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            due, _, sender = heapq.heappop(self._timers)
+            if sender._due == due:  # Otherwise rescheduled or cancelled
+                sender._due = None
+                self._guard(sender._handle_timer, now)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(1024):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _guard(self, callback, *args):
+        # Nothing raised by a sender may stop the loop
+        try:
+            callback(*args)
+        except Exception:
+            logging.exception("Unexpected error in heartbeat sender loop")
+
+    def _shutdown(self):
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                self._guard(key.data._stop)
+
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+
+_default_loop = None
+_default_loop_lock = threading.Lock()
+
+def get_default_loop():
+    global _default_loop
+
+    with _default_loop_lock:
+        if _default_loop is None:
+            _default_loop = SenderLoop()
+
+        return _default_loop
+
+
+class HeartbeatSender:
+    def __init__(self, host='localhost', port=6510, interval=1000,
+        collect_gauges=None, on_connect=None, on_disconnect=None, loop=None):
+        self.host = host
+        self.port = port
+        self.interval = interval  # Milliseconds. May be changed by the server
+        self.collect_gauges = collect_gauges
+        # Called on the loop thread as on_connect(sender) and
+        # on_disconnect(sender, error). Must not block
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.loop = loop if loop is not None else get_default_loop()
+
+        self.state = DISCONNECTED
+        self.sequence_num = 0
+
+        # Per-beat overhead in this process
+        self.beats_sent = 0
+        self.beats_skipped = 0  # Previous heartbeat still not fully sent
+        self.overhead_s = 0.0
+
+        self._sock = None
+        self._out = b''
+        self._in = ''  # Partial control message from the server
+        self._attempt = 0  # Connection attempt the pending lookup is for
+        self._last_gauges = {}
+        self._due = None
+        self._reconnect_interval_s = RECONNECT_INTERVAL_S
+
+    @property
+    def connected(self):
+        return self.state == CONNECTED
+
+    @property
+    def mean_overhead_us(self):
+        if not self.beats_sent:
+            return 0.0
+
+        return self.overhead_s / self.beats_sent * 1e6
+
+    def start(self):
+        # Returns immediately. Connection is made on the loop thread
+        self.loop.call_soon(self._start)
+
+    def stop(self):
+        self.loop.call_soon(self._stop)
+
+    ## Loop thread only
+
+    def _start(self):
+        if self.state == DISCONNECTED or self.state == STOPPED:
+            self.state = DISCONNECTED
+            self._connect()
+
+    def _stop(self):
+        was_connected = self.connected
+        self._close()
+        self.state = STOPPED
+        self._due = None
+
+        if was_connected:
+            self._notify(self.on_disconnect, None)
+
+    def _connect(self):
+        self.state = CONNECTING
+        self.sequence_num = 0  # Server tracks sequence per connection
+        self._last_gauges = {}
+        self._out = b''
+        self._in = ''
+
+        # Name resolution blocks, and would hold up the heartbeats of every
+        # sender on the loop. Look it up on a thread of its own. Covered by
+        # the connect timeout
+        self._attempt += 1
+        threading.Thread(target=self._resolve, args=(self._attempt,),
+            name='HeartbeatSenderResolver', daemon=True).start()
+        self.loop.schedule(self, time.monotonic() + CONNECT_TIMEOUT_S)
+
+    def _resolve(self, attempt):
+        # Resolver thread. IPv4 only, like client.py, as server.py only
+        # listens on IPv4. Where localhost resolves to ::1 first, the first
+        # result would never reach it
+        try:
+            addr_info = socket.getaddrinfo(self.host, self.port,
+                family=socket.AF_INET, type=socket.SOCK_STREAM)[0]
+        except OSError as e:
+            self.loop.call_soon(self._resolved, attempt, None, e)
+            return
+
+        self.loop.call_soon(self._resolved, attempt, addr_info, None)
+
+    def _resolved(self, attempt, addr_info, error):
+        if attempt != self._attempt or self.state != CONNECTING:
+            return  # Stopped or timed out in the meantime
+
+        if error is not None:
+            self._handle_error(error)
+            return
+
+        family, sock_type, proto, _, addr = addr_info
+        try:
+            self._sock = socket.socket(family, sock_type, proto)
+            self._sock.setblocking(False)
+            self._sock.connect_ex(addr)
+        except OSError as e:
+            self._handle_error(e)
+            return
+
+        self.loop.register(self._sock, selectors.EVENT_WRITE, self)
+
+    def _handle_event(self, mask):
+        if self.state == CONNECTING:
+            error = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                self._handle_error(OSError(error, "Failed to connect to "
+                    f"{self.host}:{self.port}"))
+                return
+
+            self.state = CONNECTED
+            self._reconnect_interval_s = RECONNECT_INTERVAL_S
+            self.loop.register(self._sock, selectors.EVENT_READ, self)
+            logging.info(f"Successfully connected to {self.host}:{self.port}")
+            self._notify(self.on_connect)
+
+            self.loop.schedule(self, time.monotonic())
+            return
+
+        if self.state != CONNECTED:
+            return
+
+        try:
+            if mask & selectors.EVENT_READ:
+                self._receive()
+
+            if self.connected and mask & selectors.EVENT_WRITE:
+                self._flush()
+        except OSError as e:
+            self._handle_error(e)
+
+    def _handle_timer(self, now):
+        if self.state == CONNECTING:
+            self._handle_error(TimeoutError("Timed out connecting to "
+                f"{self.host}:{self.port}"))
+        elif self.state == DISCONNECTED:
+            self._connect()
+        elif self.state == CONNECTED:
+            self._beat()
+
+            if self.connected:  # Otherwise a reconnect is already scheduled
+                self.loop.schedule(self, now + self.interval / 1000)
+
+    def _beat(self):
+        start = time.perf_counter()
+
+        if self._out:
+            # Never queue up heartbeats behind a slow connection. The sequence
+            # number is not advanced, as an --adaptive server would take the
+            # gap for lost heartbeats and ask for a shorter interval. The
+            # server sees the delay instead
+            self.beats_skipped += 1
+            return
+
+        self.sequence_num += 1
+
+        payload = ''
+        if self.collect_gauges is not None:
+            try:
+                gauges = self.collect_gauges()
+                payload = client.encode_gauges(gauges, self._last_gauges)
+                self._last_gauges.update(gauges)
+            except Exception:
+                logging.exception("Failed to collect gauges")
+
+        self._out = client.format_heartbeat(self.sequence_num,
+            payload).encode('utf-8')
+
+        try:
+            self._flush()
+        except OSError as e:
+            self._handle_error(e)
+            return
+
+        self.beats_sent += 1
+        self.overhead_s += time.perf_counter() - start
+
+    def _flush(self):
+        try:
+            sent = self._sock.send(self._out)
+        except BlockingIOError:
+            sent = 0
+
+        self._out = self._out[sent:]
+
+        # Only wait for the socket to be writable while data is pending
+        events = selectors.EVENT_READ
+        if self._out:
+            events |= selectors.EVENT_WRITE
+        self.loop.register(self._sock, events, self)
+
+    def _receive(self):
+        try:
+            data = self._sock.recv(1024)
+        except BlockingIOError:
+            return
+
+        if not data:
+            self._handle_error(ConnectionResetError("Connection closed by "
+                "server"))
+            return
+
+        try:
+            # Control messages may be split across reads
+            complete, self._in = helpers.split_complete_messages(self._in
+                + data.decode('utf-8'))
+            if len(self._in) > client.MAX_PENDING_CONTROL_DATA:
+                self._in = ''  # Not a control message
+
+            interval = client.get_interval(complete)
+        except (UnicodeDecodeError, ValueError):
+            interval = None
+
+        if interval is not None and interval > 0 and interval != self.interval:
+            logging.info(f"Server changed heartbeat interval from "
+                f"{self.interval}ms to {interval}ms")
+            self.interval = interval
+
+    def _handle_error(self, error):
+        was_connected = self.connected
+        self._close()
+        self.state = DISCONNECTED
+
+        logging.warning(f"Heartbeat connection to {self.host}:{self.port} "
+            f"failed. Retrying in {self._reconnect_interval_s:.1f}s.\n"
+            f"Error: {str(error)}")
+        if was_connected:
+            self._notify(self.on_disconnect, error)
+
+        self.loop.schedule(self, time.monotonic() + self._reconnect_interval_s)
+        self._reconnect_interval_s = min(self._reconnect_interval_s * 2,
+            MAX_RECONNECT_INTERVAL_S)
+
+    def _close(self):
+        if self._sock is not None:
+            self.loop.unregister(self._sock)
+            self._sock.close()
+            self._sock = None
+
+        self._out = b''
+
+    def _notify(self, callback, *args):
+        if callback is None:
+            return
+
+        try:
+            callback(self, *args)
+        except Exception:
+            logging.exception("Heartbeat sender callback failed")
@@ -1,12 +1,53 @@
 import sys
 import time
+import atexit
+import signal
+import struct
 import socket
 import logging
 import argparse
+import threading
 
 # Local import - Type check helpers
 import helpers
 
+# Local import - Heartbeat message parsing, shared with peer.py
+from helpers import substr_index_data_start, get_seq_num, get_timestamp
+
+# Local import - Rolling history per client
+import rollups
+
+# Local import - Optional, requires POSIX shared memory and file locks
+try:
+    import shm
+except ImportError:
+    shm = None
+
+ANOMALY_SWEEP_INTERVAL_S = 1.0
+
+# Unterminated data kept between reads before it is discarded as garbage
+MAX_PENDING_DATA = 1024
+
+# Shared memory clients are checked for this often, and reported once they
+# have not written a heartbeat for a number of their usual periods. Scans
+# themselves take time, hence the floor
+SHM_CHECK_INTERVAL_S = 0.1
+SHM_SILENCE_PERIODS = 5
+SHM_MIN_SILENCE_S = 0.1
+SHM_PERIOD_ALPHA = 0.2
+
+# Packets with a single heartbeat in a row before a backed off interval is
+# stepped back down
+RECOVERY_PACKETS = 10
+
+# Intervals without a heartbeat after which a client is suspected
+SUSPECT_INTERVALS = 2
+
+# Not exposed by the socket module. Values from Linux's asm-generic/socket.h
+SO_TIMESTAMPNS = 35
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+TIMESPEC = struct.Struct('@ll')  # struct timespec: tv_sec, tv_nsec
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Receive heartbeat from client")
 
@@ -15,30 +56,155 @@ def parse_args():
         help='Destination Port between 0 and 65535, inclusive')
     parser.add_argument('-d', '--debug', default=False, action='store_true',
         help='Enable debug logging')
+    parser.add_argument('-a', '--adaptive', default=False, action='store_true',
+        help='Adjust client heartbeat interval based on server load')
+    parser.add_argument('--min-interval', default='100',
+        type=helpers.check_positive_int,
+        help='Lowest interval in milliseconds requested from a suspected client')
+    parser.add_argument('--max-interval', default='10000',
+        type=helpers.check_positive_int,
+        help='Highest interval in milliseconds requested when server is saturated')
+    parser.add_argument('--anomaly', default=False, action='store_true',
+        help='Flag rising delay, jitter and inter-arrival period (requires NumPy)')
+    parser.add_argument('-k', '--kernel-timestamps', default=False,
+        action='store_true',
+        help='Use kernel receive timestamps to measure delay (Linux only)')
+    parser.add_argument('-q', '--query-port', default=None,
+        type=helpers.check_valid_port,
+        help='Keep per-client rollups of recent heartbeats and serve queries '
+            'for them on this local port')
+    parser.add_argument('--shm', default=None,
+        help='Also receive heartbeats from local clients through the shared '
+            'memory table with this name (requires NumPy)')
+    parser.add_argument('--shm-slots', default='4096',
+        type=helpers.check_positive_int,
+        help='Number of local clients the shared memory table can hold')
+    parser.add_argument('--shm-scan-interval', default='500',
+        type=helpers.check_positive_int,
+        help='Interval at which to scan the shared memory table in microseconds')
 
     return parser.parse_args()
 
 ## Helpers
 
-def substr_index_data_start(string, substr):
-    index = string.find(substr)
+def get_gauges(data):
+    # Expected format: "... Gauges {key}={value},{key}={value}. "
+    # Each heartbeat only carries the gauges that changed, so every heartbeat
+    # in the packet is decoded in order
+    gauges = {}
+
+    start = data.find('Gauges ')
+    while start != -1:
+        start += len('Gauges ')
+        end = data.find('. ', start)
+        if end == -1:
+            break  # Cut short by the receive buffer size
+
+        for item in data[start:end].split(','):
+            # A malformed gauge must not take the others down with it
+            try:
+                key, value = item.split('=')
+                gauges[key] = float(value)
+            except ValueError as e:
+                logging.warning(f"Failed to decode gauge {item}. "
+                    f"Error: {str(e)}")
+
+        start = data.find('Gauges ', end)
+
+    return gauges
+
+def frame_messages(pending, data):
+    # recv() returns arbitrary chunks of the stream, so a heartbeat or its
+    # gauges may be split across reads. Only complete messages are analyzed.
+    # Returns them and the rest, to be passed back in as pending
+    complete, pending = helpers.split_complete_messages(pending + data)
+    if len(pending) > MAX_PENDING_DATA:
+        logging.warning(f"Discarding unterminated data: {pending}")
+        pending = ''
+
+    return complete, pending
+
+def get_timestamps(data):
+    # Timestamps of every heartbeat in the packet, in order
+    timestamps = []
+    for heartbeat in data.split('Sequence #')[1:]:
+        try:
+            timestamps.append(get_timestamp(heartbeat))
+        except Exception:
+            continue  # Reported by analyze_heartbeat() if it is the first
+
+    return timestamps
+
+def count_heartbeats(data):
+    # More than one heartbeat per recv means the receive loop is falling behind
+    return data.count('Sequence #')
+
+def get_last_heartbeat(data):
+    # Several heartbeats may arrive in a single packet if the server fell behind.
+    # The final one may be cut short by the receive buffer size, so only look
+    # up to the end of the last complete heartbeat
+    data = data[:data.rfind('. ') + len('. ')]
+    return data[data.rfind('Sequence #'):]
+
+def get_last_seq_and_timestamp(data):
+    # Falls back to the first heartbeat if there is no complete heartbeat after
+    # it, e.g. when the packet starts with the end of a previous one
+    try:
+        last_heartbeat = get_last_heartbeat(data)
+        return get_seq_num(last_heartbeat), get_timestamp(last_heartbeat)
+    except Exception:
+        return get_seq_num(data), get_timestamp(data)
 
-    if index == -1:
-        raise Exception(f"Substring {substr} not found in string {string}")
+## Helpers - End
 
-    return index + len(substr)  # Data starts after substr passed in
+## Adaptive interval
 
-def get_seq_num(data):
-    # Expected format: "Sequence #{seq_num}: Sending heartbeat at {timestamp}. "
-    seq_num = data[substr_index_data_start(data, '#') : data.find(':')]
-    return int(seq_num)
+def estimate_interval(seq_num, time_sent, last_seq_recvd, last_time_sent):
+    # Client timestamps are taken right before sending, so their spacing is
+    # the interval the client is currently using
+    seq_diff = seq_num - last_seq_recvd
+    if seq_diff <= 0:
+        return None
 
-def get_timestamp(data):
-    # Expected format: "Sequence #{seq_num}: Sending heartbeat at {timestamp}. "
-    timestamp = data[substr_index_data_start(data, ' at ') : data.find('. ')]
-    return float(timestamp)
+    return max(1, round((time_sent - last_time_sent) * 1000 / seq_diff))
 
-## Helpers - End
+def is_late(time_recvd, last_time_recvd, interval_ms):
+    # TCP delivers every heartbeat in order, so a client in trouble shows up
+    # as heartbeats arriving late rather than as gaps in sequence numbers
+    gap_ms = (time_recvd - last_time_recvd) * 1000
+    return gap_ms > SUSPECT_INTERVALS * interval_ms
+
+def compute_interval(interval_ms, base_interval_ms, saturated, suspected,
+    min_interval_ms, max_interval_ms, calm_packets=RECOVERY_PACKETS):
+    if saturated:
+        # Back off so that load on the server degrades gracefully
+        return max(interval_ms, min(interval_ms * 2, max_interval_ms))
+
+    if suspected:
+        # Probe faster to confirm or clear the suspicion quickly
+        return min(interval_ms, max(interval_ms // 2, min_interval_ms))
+
+    # Recover towards the interval the client was started with, once the
+    # server has kept up for a while. Stepping down on the first packet
+    # after backing off would flap between the two under sustained load
+    if interval_ms > base_interval_ms:
+        if calm_packets < RECOVERY_PACKETS:
+            return interval_ms
+        return max(interval_ms // 2, base_interval_ms)
+
+    return base_interval_ms
+
+def send_interval_update(connection, interval_ms):
+    data = f"Interval: {interval_ms}. "
+    logging.info(f"Requesting heartbeat interval of {interval_ms}ms")
+
+    try:
+        connection.sendall(data.encode('utf-8'))
+    except (BrokenPipeError, ConnectionResetError) as e:
+        logging.warning("Failed to send interval update to client. "
+            f"Error: {str(e)}")
+
+## Adaptive interval - End
 
 def bind_socket_and_listen(socket, port):
     try:
@@ -52,9 +218,40 @@ def bind_socket_and_listen(socket, port):
 
     socket.listen(1)
 
-def receive_heartbeat(connection):
-    bytes = connection.recv(1024)
-    time_recvd = time.time()
+def enable_kernel_timestamps(connection):
+    if not sys.platform.startswith('linux'):
+        logging.warning("Kernel timestamps are only supported on Linux. "
+            "Falling back to timestamping after receiving.")
+        return False
+
+    try:
+        connection.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    except OSError as e:
+        logging.warning("Failed to enable kernel timestamps. Falling back to "
+            f"timestamping after receiving.\nError: {str(e)}")
+        return False
+
+    return True
+
+def get_kernel_timestamp(ancdata):
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if (cmsg_level == socket.SOL_SOCKET and cmsg_type == SCM_TIMESTAMPNS
+            and len(cmsg_data) >= TIMESPEC.size):
+            tv_sec, tv_nsec = TIMESPEC.unpack(cmsg_data[:TIMESPEC.size])
+            return tv_sec + tv_nsec / 1e9
+
+    return None
+
+def receive_heartbeat(connection, kernel_timestamps=False):
+    if kernel_timestamps:
+        # Time the packet was received by the kernel, unaffected by how long
+        # it waited for this process to be scheduled
+        bytes, ancdata, flags, addr = connection.recvmsg(1024,
+            socket.CMSG_SPACE(TIMESPEC.size))
+        time_recvd = get_kernel_timestamp(ancdata) or time.time()
+    else:
+        bytes = connection.recv(1024)
+        time_recvd = time.time()
 
     data = bytes.decode('utf-8')
     if not data:  # Connection likely closed by client
@@ -65,25 +262,221 @@ def receive_heartbeat(connection):
 
     return data, time_recvd
 
-def analyze_heartbeat(data, last_seq_recvd, time_recvd):
-    try:
-        # Check if any messages were missed
-        seq_num = get_seq_num(data)
-        if seq_num > (last_seq_recvd+1):
-            logging.warning("Missed heartbeat(s) with sequence number "
-                f"{*range(last_seq_recvd+1, seq_num),}")
-
-        # Measure delay between sending and receiving heartbeat
-        time_sent = get_timestamp(data)
-        duration_ms = (time_recvd - time_sent) * 1000
-        logging.debug(f"Message took {duration_ms:.4f}ms to be received.")
-
-        return seq_num
-    except Exception as e:
-        logging.warning(f"Failed to analyze heartbeat with data: {data}.\n"
-            f"Error: {str(e)}")
-
-        return last_seq_recvd
+def check_heartbeat(seq_num, time_sent, last_seq_recvd, time_recvd,
+    history=None, client=None):
+    # Check if any messages were missed
+    missed = 0
+    if seq_num > (last_seq_recvd+1):
+        missed = seq_num - last_seq_recvd - 1
+        logging.warning("Missed heartbeat(s) with sequence number "
+            f"{*range(last_seq_recvd+1, seq_num),}")
+
+    # Measure delay between sending and receiving heartbeat
+    duration_ms = (time_recvd - time_sent) * 1000
+    logging.debug(f"Message took {duration_ms:.4f}ms to be received.")
+
+    if history is not None:
+        history.record(client, time_recvd, duration_ms, missed)
+
+    return seq_num
+
+def analyze_heartbeat(data, last_seq_recvd, time_recvd, history=None,
+    client=None):
+    # Several heartbeats may arrive in a single packet if the server fell
+    # behind. Each one is checked in turn, so that heartbeats queued behind
+    # the first are recorded as delayed rather than reported as missed
+    heartbeats = [f"Sequence #{heartbeat}"
+        for heartbeat in data.split('Sequence #')[1:]]
+
+    for heartbeat in heartbeats or [data]:
+        try:
+            last_seq_recvd = check_heartbeat(get_seq_num(heartbeat),
+                get_timestamp(heartbeat), last_seq_recvd, time_recvd, history,
+                client)
+        except Exception as e:
+            logging.warning("Failed to analyze heartbeat with data: "
+                f"{heartbeat}.\nError: {str(e)}")
+
+    return last_seq_recvd
+
+def update_client_gauges(client_gauges, client_addr, data):
+    gauges = get_gauges(data)
+    if gauges:
+        client_gauges[client_addr].update(gauges)
+        logging.debug(f"Gauges for {client_addr}: {client_gauges[client_addr]}")
+
+    return client_gauges[client_addr]
+
+## Shared memory transport
+
+def new_shm_clients(n_slots):
+    # State of the process using each slot, in columns so that a scan is
+    # processed with a few vectorized operations, however many clients beat.
+    # NumPy is only needed with --shm, so it is only imported then
+    import numpy as np
+
+    return {'pid': np.zeros(n_slots, dtype=np.int64),
+        'seq_num': np.zeros(n_slots, dtype=np.int64),
+        'time_sent': np.zeros(n_slots), 'last_change': np.zeros(n_slots),
+        'period_s': np.full(n_slots, np.nan),
+        'silent': np.zeros(n_slots, dtype=bool),
+        'fleet_slot': np.zeros(n_slots, dtype=np.int64)}
+
+def add_shm_client(shm_clients, slot, pid, seq_num, time_sent, time_recvd,
+    fleet=None):
+    # The current sequence number is the baseline, as the client may have
+    # been running for a long time, e.g. across a server restart
+    shm_clients['pid'][slot] = pid
+    shm_clients['seq_num'][slot] = seq_num
+    shm_clients['time_sent'][slot] = time_sent
+    shm_clients['last_change'][slot] = time_recvd
+    shm_clients['period_s'][slot] = float('nan')
+    shm_clients['silent'][slot] = False
+
+    if fleet is not None:
+        shm_clients['fleet_slot'][slot] = fleet.add_client(f"shm:{pid}")
+
+def remove_shm_client(shm_clients, slot, fleet=None):
+    pid = int(shm_clients['pid'][slot])
+    shm_clients['pid'][slot] = 0
+
+    if fleet is not None:
+        fleet.remove_client(f"shm:{pid}")
+
+def scan_shm_heartbeats(reader, shm_clients, time_recvd, history=None,
+    fleet=None):
+    import numpy as np
+
+    slots, pids, seq_nums, timestamps = reader.scan()
+
+    # Processes attaching and detaching are rare, so handled one at a time
+    for i in (pids != shm_clients['pid'][slots]).nonzero()[0].tolist():
+        slot, pid = int(slots[i]), int(pids[i])
+
+        if shm_clients['pid'][slot]:
+            logging.info(f"Process {shm_clients['pid'][slot]} detached from "
+                f"shared memory slot {slot}")
+            remove_shm_client(shm_clients, slot, fleet)
+
+        if pid:
+            logging.info(f"Process {pid} attached to shared memory slot {slot}")
+            add_shm_client(shm_clients, slot, pid, int(seq_nums[i]),
+                float(timestamps[i]), time_recvd, fleet)
+
+    seq_diff = seq_nums - shm_clients['seq_num'][slots]
+    beating = (pids != 0) & (seq_diff > 0)
+    if not beating.any():
+        return
+
+    slots, pids, seq_nums, timestamps, seq_diff = (slots[beating],
+        pids[beating], seq_nums[beating], timestamps[beating],
+        seq_diff[beating])
+
+    # A slot only holds the latest heartbeat. Heartbeats overwritten
+    # between two scans were delivered late rather than lost, so they are
+    # not reported as missed. A client that stops is caught by
+    # check_shm_clients() instead
+    overwritten = int(seq_diff.sum()) - len(slots)
+    if overwritten:
+        logging.debug(f"{overwritten} heartbeat(s) overwritten between scans")
+
+    delays_ms = (time_recvd - timestamps) * 1000
+    logging.debug(f"{len(slots)} heartbeat(s) from shared memory took up to "
+        f"{delays_ms.max():.4f}ms to be received.")
+
+    if history is not None:
+        # Rollups are kept per client, so this part costs per heartbeat
+        for pid, delay_ms in zip(pids.tolist(), delays_ms.tolist()):
+            history.record(f"shm:{pid}", time_recvd, delay_ms, 0)
+
+    if fleet is not None:
+        fleet.record_many(shm_clients['fleet_slot'][slots], delays_ms,
+            time_recvd)
+
+    # Usual period of each client, to tell when it goes silent. A newly
+    # claimed slot has no previous heartbeat to measure it from
+    time_sent = shm_clients['time_sent'][slots]
+    period_s = (timestamps - time_sent) / seq_diff
+    ewma_s = shm_clients['period_s'][slots]
+    ewma_s = np.where(np.isnan(ewma_s), period_s,
+        ewma_s + SHM_PERIOD_ALPHA * (period_s - ewma_s))
+    measured = time_sent != 0
+    shm_clients['period_s'][slots[measured]] = ewma_s[measured]
+
+    for slot in slots[shm_clients['silent'][slots]].tolist():
+        logging.info(f"Process {shm_clients['pid'][slot]} in shared memory "
+            f"slot {slot} resumed heartbeats")
+    shm_clients['silent'][slots] = False
+
+    shm_clients['seq_num'][slots] = seq_nums
+    shm_clients['time_sent'][slots] = timestamps
+    shm_clients['last_change'][slots] = time_recvd
+
+def check_shm_clients(shm_clients, now, fleet=None):
+    import numpy as np
+
+    # Only clients that stopped writing need a closer look. Those killed
+    # without a chance to free their slot leave it as it was, so the scan
+    # alone never notices them
+    limit_s = np.fmax(SHM_SILENCE_PERIODS * shm_clients['period_s'],
+        SHM_MIN_SILENCE_S)
+    quiet = (shm_clients['pid'] != 0) & (now - shm_clients['last_change']
+        > limit_s)
+
+    for slot in quiet.nonzero()[0].tolist():
+        pid = int(shm_clients['pid'][slot])
+
+        if not shm.is_running(pid):
+            logging.warning(f"Process {pid} exited without detaching from "
+                f"shared memory slot {slot}")
+            remove_shm_client(shm_clients, slot, fleet)
+            continue
+
+        # Not reported until its usual period is known
+        if shm_clients['silent'][slot] or np.isnan(
+            shm_clients['period_s'][slot]):
+            continue
+
+        silence_s = now - shm_clients['last_change'][slot]
+        logging.warning(f"No heartbeat from process {pid} in shared memory "
+            f"slot {slot} for {silence_s:.3f}s")
+        shm_clients['silent'][slot] = True
+
+def run_shm_scanner(reader, scan_interval_us, stop, history=None, fleet=None):
+    # Runs until stop is set. Anomaly statistics for shared memory clients are
+    # kept in their own fleet, owned by this thread
+    shm_clients = new_shm_clients(reader.table.n_slots)
+    next_check = next_sweep = time.time()
+
+    while not stop.is_set():
+        now = time.time()
+        try:
+            scan_shm_heartbeats(reader, shm_clients, now, history, fleet)
+
+            if now >= next_check:
+                check_shm_clients(shm_clients, now, fleet)
+                next_check = now + SHM_CHECK_INTERVAL_S
+
+            if fleet is not None and now >= next_sweep:
+                fleet.log_anomalies(now)
+                next_sweep = now + ANOMALY_SWEEP_INTERVAL_S
+        except Exception as e:
+            logging.error(f"Exception caught while scanning shared memory: "
+                f"{str(e)}")
+
+        stop.wait(scan_interval_us / 1e6)
+
+def release_shm_table(reader, scanner, stop):
+    stop.set()
+    scanner.join()
+
+    if reader.release():
+        logging.info(f"Removed shared memory table {reader.table.name}")
+    else:
+        logging.info(f"Leaving shared memory table {reader.table.name} in "
+            "place for the clients still attached to it")
+
+## Shared memory transport - End
 
 
 if __name__ == '__main__':
@@ -92,6 +485,57 @@ if __name__ == '__main__':
     logging_level = logging.DEBUG if args.debug else logging.INFO
     logging.basicConfig(level=logging_level)
 
+    # Exit through SystemExit, so that cleanup registered with atexit runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Latest gauge values reported by each connected client
+    client_gauges = {}
+
+    fleet = None
+    if args.anomaly:
+        # Local import - Requires NumPy, which is only loaded when needed
+        try:
+            import anomaly
+        except ImportError:
+            logging.error("Anomaly detection requires NumPy. Please install "
+                "it with 'pip3 install numpy'")
+            sys.exit(1)
+
+        fleet = anomaly.FleetStats()
+        next_sweep = time.time() + ANOMALY_SWEEP_INTERVAL_S
+
+    history = None
+    if args.query_port is not None:
+        history = rollups.Rollups()
+        logging.info("Keeping rollups of up to "
+            f"{history.bytes_per_client // 1024}KiB per client for up to "
+            f"{history.max_clients} clients")
+        threading.Thread(target=rollups.serve_queries,
+            args=(history, args.query_port), daemon=True).start()
+
+    if args.shm:
+        if shm is None:
+            logging.error("Shared memory transport is not supported on this "
+                "platform")
+            sys.exit(1)
+
+        try:
+            reader = shm.ShmHeartbeatReader(args.shm, args.shm_slots)
+        except ImportError:
+            logging.error("Shared memory transport requires NumPy. Please "
+                "install it with 'pip3 install numpy'")
+            sys.exit(1)
+        logging.info(f"Scanning shared memory table {args.shm} for heartbeats "
+            f"every {args.shm_scan_interval}us")
+
+        stop_scanner = threading.Event()
+        scanner = threading.Thread(target=run_shm_scanner,
+            args=(reader, args.shm_scan_interval, stop_scanner, history,
+                anomaly.FleetStats() if args.anomaly else None),
+            daemon=True)
+        scanner.start()
+        atexit.register(release_shm_table, reader, scanner, stop_scanner)
+
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         bind_socket_and_listen(s, args.port)
 
@@ -99,24 +543,114 @@ if __name__ == '__main__':
             logging.info(f"Awaiting connection from client on port "
                 f"{args.port}...")
             last_seq_recvd = 0
+            last_seq_seen = 0
+            last_time_sent = last_time_recvd = None
+            interval_ms = base_interval_ms = last_interval_ms = None
+            calm_packets = 0  # Packets with a single heartbeat in a row
+            pending = ''  # Partial message carried over to the next read
 
             connection, client_addr = s.accept()
 
+            # Gauges are delta-encoded per connection, so start from scratch
+            client_gauges[client_addr] = {}
+
+            if fleet is not None:
+                slot = fleet.add_client(client_addr)
+                # Wake up periodically to detect clients that went silent
+                connection.settimeout(ANOMALY_SWEEP_INTERVAL_S)
+
             with connection:
                 logging.info(f"Accepted connection from {client_addr}")
 
+                kernel_timestamps = (args.kernel_timestamps
+                    and enable_kernel_timestamps(connection))
+
                 # Runs per heartbeat message received for established connection
                 while True:
                     try:
-                        data, time_recvd = receive_heartbeat(connection)
+                        data, time_recvd = receive_heartbeat(connection,
+                            kernel_timestamps)
                         if not data:
                             break  # Connection broken. Await new connection
 
-                        last_seq_recvd = analyze_heartbeat(data, last_seq_recvd,
-                            time_recvd)
-
+                        data, pending = frame_messages(pending, data)
+
+                        seq_num = last_seq_recvd
+                        if count_heartbeats(data):  # Not only gauges
+                            seq_num = analyze_heartbeat(data, last_seq_recvd,
+                                time_recvd, history,
+                                f"{client_addr[0]}:{client_addr[1]}")
+                        update_client_gauges(client_gauges, client_addr, data)
+
+                        if fleet is not None and seq_num != last_seq_recvd:
+                            # First one was already parsed by analyze_heartbeat
+                            timestamps = (get_timestamps(data)
+                                or [get_timestamp(data)])
+                            fleet.record(slot,
+                                (time_recvd - timestamps[0]) * 1000, time_recvd)
+                            # Queued heartbeats carry the delay that matters
+                            # most under load
+                            for time_sent in timestamps[1:]:
+                                fleet.record_delay(slot,
+                                    (time_recvd - time_sent) * 1000)
+
+                        if args.adaptive and seq_num != last_seq_recvd:
+                            # Heartbeats queued behind the first one in this
+                            # packet were not lost, only delayed
+                            seq_seen, time_sent = get_last_seq_and_timestamp(
+                                data)
+                            saturated = count_heartbeats(data) > 1
+                            calm_packets = 0 if saturated else calm_packets + 1
+
+                            if base_interval_ms is None:
+                                if last_time_sent is not None:
+                                    base_interval_ms = estimate_interval(seq_seen,
+                                        time_sent, last_seq_seen, last_time_sent)
+                                    interval_ms = base_interval_ms
+                                    last_interval_ms = base_interval_ms
+                            else:
+                                # A client may still be sleeping on the interval
+                                # it used before the latest update
+                                suspected = is_late(time_recvd, last_time_recvd,
+                                    max(interval_ms, last_interval_ms))
+                                new_interval_ms = compute_interval(interval_ms,
+                                    base_interval_ms,
+                                    saturated=saturated,
+                                    suspected=suspected,
+                                    min_interval_ms=args.min_interval,
+                                    max_interval_ms=args.max_interval,
+                                    calm_packets=calm_packets)
+
+                                last_interval_ms = interval_ms
+                                if new_interval_ms != interval_ms:
+                                    send_interval_update(connection,
+                                        new_interval_ms)
+                                    interval_ms = new_interval_ms
+                                    calm_packets = 0
+
+                                    # Period changes requested by the server
+                                    # are not anomalies
+                                    if fleet is not None:
+                                        fleet.reset_period(slot)
+
+                            last_seq_seen = seq_seen
+                            last_time_sent = time_sent
+                            last_time_recvd = time_recvd
+
+                        last_seq_recvd = seq_num
+
+                    except socket.timeout:
+                        pass  # No heartbeat within the sweep interval
 
                     except Exception as e:
                         logging.error(f"Exception caught while receiving data: "
                             f"{str(e)}")
                         break
+
+                    if fleet is not None and time.time() >= next_sweep:
+                        fleet.log_anomalies(time.time())
+                        next_sweep = time.time() + ANOMALY_SWEEP_INTERVAL_S
+
+            del client_gauges[client_addr]
+            if fleet is not None:
+                fleet.remove_client(client_addr)
@@ -0,0 +1,232 @@
+import os
+import time
+import fcntl
+import struct
+import logging
+import tempfile
+
+from multiprocessing import shared_memory, resource_tracker
+
+# Shared-memory heartbeat transport for processes on the same host.
+#
+# Each client claims a slot in a table and writes its sequence number and
+# timestamp there on every heartbeat, without any syscall. The server scans
+# the table for slots that changed and feeds them to the same gap and delay
+# analysis as TCP heartbeats.
+#
+# Layout: header, then one column per field (struct of arrays), so that the
+# server can find and read changed slots with a few vectorized operations.
+#
+#   magic | n_slots | versions[n] | pids[n] | seq_nums[n] | timestamps[n]
+#
+# A slot's version is odd while its client is writing to it (seqlock), so the
+# server never reads a sequence number and timestamp from different heartbeats.
+
+MAGIC = b'HBSHM001'
+HEADER = struct.Struct('<8sQ')
+FIELD_SIZE = 8  # All columns hold 8 byte values
+
+
+def table_size(n_slots):
+    return HEADER.size + 4 * FIELD_SIZE * n_slots
+
+def lock_path(name):
+    return os.path.join(tempfile.gettempdir(), f"{name}.lock")
+
+def _untrack(shm):
+    # Before Python 3.13, attaching to shared memory registers it to be
+    # unlinked when this process exits, which would pull the table away from
+    # the server and the other clients
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, owned by another user
+
+    return True
+
+
+class HeartbeatTable:
+    def __init__(self, shm):
+        self.shm = shm
+
+        magic, self.n_slots = HEADER.unpack_from(shm.buf)
+        if magic != MAGIC:
+            shm.close()
+            raise ValueError(f"Shared memory {shm.name} is not a heartbeat "
+                "table")
+
+        def column(index, fmt):
+            start = HEADER.size + index * FIELD_SIZE * self.n_slots
+            end = start + FIELD_SIZE * self.n_slots
+            return shm.buf[start:end].cast(fmt)
+
+        self.versions = column(0, 'Q')
+        self.pids = column(1, 'q')
+        self.seq_nums = column(2, 'Q')
+        self.timestamps = column(3, 'd')
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @classmethod
+    def create(cls, name, n_slots):
+        # Reuses an existing table, so clients survive a server restart
+        try:
+            shm = shared_memory.SharedMemory(name, create=True,
+                size=table_size(n_slots))
+            HEADER.pack_into(shm.buf, 0, MAGIC, n_slots)
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(name)
+
+        _untrack(shm)
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name)
+        _untrack(shm)
+        return cls(shm)
+
+    def close(self):
+        # Views must be released before the shared memory can be closed
+        for view in (self.versions, self.pids, self.seq_nums, self.timestamps):
+            view.release()
+        self.shm.close()
+
+    def unlink(self):
+        # Registered again, as unlink() expects to remove it from the tracker
+        try:
+            resource_tracker.register(self.shm._name, 'shared_memory')
+        except Exception:
+            pass
+
+        self.shm.unlink()
+
+
+class ShmHeartbeatWriter:
+    def __init__(self, name):
+        self.table = HeartbeatTable.attach(name)
+        self.pid = os.getpid()
+        self.slot = self._claim_slot()
+
+    def _claim_slot(self):
+        table = self.table
+
+        # Claiming is rare, so a file lock is fine here. Heartbeats themselves
+        # never take it
+        with open(lock_path(table.name), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            for slot in range(table.n_slots):
+                pid = table.pids[slot]
+                if pid == 0 or not is_running(pid):
+                    # Server sees the new pid and resets its state for the slot
+                    self._write(slot, pid=self.pid, seq_num=0, timestamp=0.0)
+                    return slot
+
+        table.close()
+        raise RuntimeError(f"No free slot in heartbeat table {table.name}")
+
+    def _write(self, slot, seq_num, timestamp, pid=None):
+        table = self.table
+        version = table.versions[slot]
+
+        table.versions[slot] = version + 1  # Odd while writing
+        if pid is not None:
+            table.pids[slot] = pid
+        table.seq_nums[slot] = seq_num
+        table.timestamps[slot] = timestamp
+        table.versions[slot] = version + 2
+
+    def beat(self, seq_num, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        self._write(self.slot, seq_num, timestamp)
+        return timestamp
+
+    def close(self):
+        self._write(self.slot, pid=0, seq_num=0, timestamp=0.0)
+        self.table.close()
+
+
+class ShmHeartbeatReader:
+    def __init__(self, name, n_slots):
+        # Only the server needs NumPy. Clients import this module too, and
+        # stay lightweight without it
+        import numpy as np
+
+        self.table = HeartbeatTable.create(name, n_slots)
+        if self.table.n_slots != n_slots:
+            logging.warning(f"Reusing heartbeat table {name} with "
+                f"{self.table.n_slots} slots instead of {n_slots}")
+
+        def column(index, dtype):
+            return np.frombuffer(self.table.shm.buf, dtype=dtype,
+                count=self.table.n_slots,
+                offset=HEADER.size + index * FIELD_SIZE * self.table.n_slots)
+
+        self.versions = column(0, np.uint64)
+        self.pids = column(1, np.int64)
+        self.seq_nums = column(2, np.int64)
+        self.timestamps = column(3, np.float64)
+
+        self.last_versions = np.zeros(self.table.n_slots, dtype=np.uint64)
+
+    def scan(self):
+        # Returns arrays of the slots written since the last scan, and their
+        # pids, sequence numbers and timestamps
+        versions = self.versions.copy()
+        changed = (versions != self.last_versions).nonzero()[0]
+
+        pids = self.pids[changed]
+        seq_nums = self.seq_nums[changed]
+        timestamps = self.timestamps[changed]
+
+        # Clients mid-write are picked up on the next scan
+        versions = versions[changed]
+        consistent = (versions % 2 == 0) & (self.versions[changed] == versions)
+
+        changed = changed[consistent]
+        self.last_versions[changed] = versions[consistent]
+
+        return (changed, pids[consistent], seq_nums[consistent],
+            timestamps[consistent])
+
+    def close(self):
+        # Arrays over the table must be gone before it can be closed
+        self.versions = self.pids = self.seq_nums = self.timestamps = None
+        self.table.close()
+
+    def unlink(self):
+        self.table.unlink()
+
+    def release(self):
+        # Closes the table, and removes it along with its lock file unless live
+        # clients still use it, so that they find it again when the server
+        # restarts. Returns whether it was removed
+        table = self.table
+        path = lock_path(table.name)
+
+        # Held so that no client claims a slot in the meantime
+        with open(path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            in_use = any(pid and is_running(pid) for pid in table.pids)
+            self.close()
+            if in_use:
+                return False
+
+            table.unlink()
+            os.remove(path)
+
+        return True
@@ -0,0 +1,259 @@
+import time
+import pytest
+
+np = pytest.importorskip("numpy")
+
+# Local import
+import anomaly
+
+
+# Helper
+def run_ticks(fleet, ticks, start=1752000000.0, delay_ms=5.0, period_s=1.0,
+    clients=None, delay_fn=None, period_fn=None):
+    # Simulates one heartbeat per client per sweep
+    clients = clients if clients is not None else list(fleet.slots)
+    now = start
+
+    for tick in range(ticks):
+        period = period_fn(tick) if period_fn else period_s
+        now += period
+        for client in clients:
+            delay = delay_fn(tick) if delay_fn else delay_ms
+            fleet.record(fleet.slots[client], delay, now)
+
+        slots, reasons = fleet.sweep(now + 0.01)
+
+    return now, slots, reasons
+
+
+## Test slots
+
+def test_add_client_assigns_slots():
+    fleet = anomaly.FleetStats(capacity=4)
+
+    assert fleet.add_client('a') == 0
+    assert fleet.add_client('b') == 1
+    assert fleet.add_client('a') == 0  # Already known
+    assert len(fleet) == 2
+
+def test_remove_client_frees_slot():
+    fleet = anomaly.FleetStats(capacity=4)
+    fleet.add_client('a')
+    slot = fleet.add_client('b')
+
+    fleet.remove_client('b')
+
+    assert not fleet.active[slot]
+    assert fleet.add_client('c') == slot
+    assert fleet.clients[slot] == 'c'
+
+def test_add_client_grows_capacity():
+    fleet = anomaly.FleetStats(capacity=2)
+    fleet.add_client('a')
+    fleet.fast_delay_mean[0] = 12.5
+
+    for client in 'bcde':
+        fleet.add_client(client)
+
+    assert fleet.capacity == 8
+    assert len(fleet.fast_delay_mean) == 8
+    assert fleet.fast_delay_mean[0] == 12.5  # Existing stats kept
+    assert sorted(fleet.slots.values()) == [0, 1, 2, 3, 4]
+
+def test_reused_slot_is_reset():
+    fleet = anomaly.FleetStats(capacity=2)
+    fleet.add_client('a')
+    run_ticks(fleet, 3)
+
+    fleet.remove_client('a')
+    slot = fleet.add_client('b')
+
+    assert fleet.delay_samples[slot] == 0
+    assert fleet.slow_delay_mean[slot] == 0
+    assert fleet.last_arrival[slot] == 0
+
+
+## Test record()
+
+def test_record_accumulates():
+    fleet = anomaly.FleetStats(capacity=2)
+    slot = fleet.add_client('a')
+
+    fleet.record(slot, 5.0, 100.0)
+    fleet.record(slot, 7.0, 100.5)
+
+    assert fleet.delay_sum[slot] == 12.0
+    assert fleet.delay_count[slot] == 2
+    # No period for the first heartbeat
+    assert fleet.period_sum[slot] == pytest.approx(500.0)
+    assert fleet.period_count[slot] == 1
+    assert fleet.last_arrival[slot] == 100.5
+
+def test_record_delay_has_no_period():
+    fleet = anomaly.FleetStats(capacity=2)
+    slot = fleet.add_client('a')
+
+    fleet.record(slot, 5.0, 100.0)
+    fleet.record_delay(slot, 9.0)
+
+    assert fleet.delay_sum[slot] == 14.0
+    assert fleet.delay_count[slot] == 2
+    assert fleet.period_count[slot] == 0
+    assert fleet.last_arrival[slot] == 100.0
+
+def test_record_many_matches_record():
+    fleet = anomaly.FleetStats(capacity=4)
+    batched = anomaly.FleetStats(capacity=4)
+    for client in 'abc':
+        fleet.add_client(client)
+        batched.add_client(client)
+
+    fleet.record(0, 5.0, 100.0)
+    batched.record(0, 5.0, 100.0)
+    for slot, delay_ms in ((0, 7.0), (2, 9.0)):
+        fleet.record(slot, delay_ms, 100.5)
+    batched.record_many(np.array([0, 2]), np.array([7.0, 9.0]), 100.5)
+
+    for column in ('delay_sum', 'delay_count', 'period_sum', 'period_count',
+        'last_arrival'):
+        assert getattr(batched, column) == pytest.approx(getattr(fleet, column))
+
+
+## Test sweep()
+
+def test_sweep_steady_clients_not_flagged():
+    fleet = anomaly.FleetStats(capacity=16)
+    for client in range(10):
+        fleet.add_client(client)
+
+    rng = np.random.default_rng(6510)
+    now, slots, reasons = run_ticks(fleet, 60,
+        delay_fn=lambda tick: 5 + rng.normal(0, 0.2))
+
+    assert len(slots) == 0
+    assert len(reasons) == len(anomaly.REASONS)
+
+def test_sweep_not_flagged_during_warmup():
+    fleet = anomaly.FleetStats(capacity=4, warmup=10)
+    fleet.add_client('a')
+
+    now, slots, reasons = run_ticks(fleet, 5,
+        delay_fn=lambda tick: 5 if tick < 3 else 500)
+
+    assert len(slots) == 0
+
+def test_sweep_rising_delay():
+    fleet = anomaly.FleetStats(capacity=4)
+    slot = fleet.add_client('a')
+
+    now, slots, reasons = run_ticks(fleet, 20)
+    now, slots, reasons = run_ticks(fleet, 10, start=now,
+        delay_fn=lambda tick: 5 + 3 * tick)
+
+    assert list(slots) == [slot]
+    assert reasons[anomaly.REASONS.index('delay')][0]
+
+def test_sweep_growing_jitter():
+    fleet = anomaly.FleetStats(capacity=4)
+    slot = fleet.add_client('a')
+
+    rng = np.random.default_rng(6510)
+    now, slots, reasons = run_ticks(fleet, 20,
+        delay_fn=lambda tick: 5 + rng.normal(0, 0.5))
+    now, slots, reasons = run_ticks(fleet, 10, start=now,
+        delay_fn=lambda tick: 5 + (20 if tick % 2 else -4))
+
+    assert list(slots) == [slot]
+    assert reasons[anomaly.REASONS.index('jitter')][0]
+
+def test_sweep_stretching_period():
+    fleet = anomaly.FleetStats(capacity=4)
+    slot = fleet.add_client('a')
+
+    now, slots, reasons = run_ticks(fleet, 20)
+    now, slots, reasons = run_ticks(fleet, 10, start=now,
+        period_fn=lambda tick: 1.0 + 0.05 * (tick + 1))
+
+    assert list(slots) == [slot]
+    assert reasons[anomaly.REASONS.index('period')][0]
+
+def test_sweep_period_reset_after_interval_change():
+    fleet = anomaly.FleetStats(capacity=4)
+    changed = fleet.add_client('changed')
+    reset = fleet.add_client('reset')
+
+    now, slots, reasons = run_ticks(fleet, 20)
+
+    # Both clients were asked to halve their rate. Only one had its period
+    # baseline reset, as the server does when it sends an interval update
+    fleet.reset_period(reset)
+    now, slots, reasons = run_ticks(fleet, 5, start=now, period_s=2.0)
+
+    assert list(slots) == [changed]
+    assert fleet.slow_delay_mean[reset] == pytest.approx(5.0)  # Kept
+
+def test_sweep_silent_client():
+    fleet = anomaly.FleetStats(capacity=4)
+    fleet.add_client('steady')
+    slot = fleet.add_client('silent')
+
+    now, slots, reasons = run_ticks(fleet, 20)
+
+    # Only the steady client keeps sending
+    now, slots, reasons = run_ticks(fleet, 3, start=now, clients=['steady'])
+
+    assert list(slots) == [slot]
+    assert reasons[anomaly.REASONS.index('silence')][0]
+
+def test_sweep_level_shift_accepted():
+    fleet = anomaly.FleetStats(capacity=4)
+    fleet.add_client('a')
+
+    now, slots, reasons = run_ticks(fleet, 20)
+    now, slots, reasons = run_ticks(fleet, 5, start=now, delay_ms=50)
+    assert len(slots) == 1
+
+    # Baseline eventually takes in a lasting change
+    now, slots, reasons = run_ticks(fleet, 300, start=now, delay_ms=50)
+    assert len(slots) == 0
+
+def test_sweep_ignores_removed_clients():
+    fleet = anomaly.FleetStats(capacity=4)
+    fleet.add_client('a')
+    run_ticks(fleet, 20)
+
+    fleet.remove_client('a')
+    slots, reasons = fleet.sweep(1752000000.0 + 3600)
+
+    assert len(slots) == 0
+
+def test_sweep_fleet_scale():
+    n_clients = 100000
+    fleet = anomaly.FleetStats(capacity=n_clients)
+    for client in range(n_clients):
+        fleet.add_client(client)
+
+    fleet.delay_sum[:] = 5.0
+    fleet.delay_count[:] = 1
+
+    start = time.perf_counter()
+    fleet.sweep(time.time())
+    duration_s = time.perf_counter() - start
+
+    # Milliseconds in practice. Kept loose to avoid flakiness on slow runners
+    assert duration_s < 0.5
+
+
+## Test log_anomalies()
+
+def test_log_anomalies(mock_logging_warn):
+    fleet = anomaly.FleetStats(capacity=4)
+    fleet.add_client(('127.0.0.1', 40000))
+
+    now, slots, reasons = run_ticks(fleet, 20)
+    flagged = fleet.log_anomalies(now + 10)
+
+    assert flagged == [('127.0.0.1', 40000)]
+    mock_logging_warn.assert_called_once()
+    assert "Anomaly detected for ('127.0.0.1', 40000): silence" in \
+        mock_logging_warn.call_args[0][0]
@@ -2,7 +2,7 @@ import sys
 import random
 import pytest
 
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 # Local import
 import client
@@ -67,6 +67,12 @@ def test_valid_interval():
         args = client.parse_args()
         assert args.interval == interval
 
+def test_valid_fractional_interval():
+    test_args = ['client.py', '--interval', '0.25']
+    with patch.object(sys, 'argv', test_args):
+        args = client.parse_args()
+        assert args.interval == 0.25
+
 def test_invalid_interval_negative():
     interval = random.randint(-sys.maxsize, -1)
 
@@ -97,6 +103,27 @@ def test_invalid_interval_string():
 
         assert sysexit.value.code == 2
 
+def test_invalid_interval_infinite():
+    test_args = ['client.py', '--interval', 'inf']
+    with patch.object(sys, 'argv', test_args):
+        with pytest.raises(SystemExit) as sysexit:
+            args = client.parse_args()
+
+        assert sysexit.value.code == 2
+
+# Gauges
+def test_gauges_set():
+    test_args = ['client.py', '--gauges']
+    with patch.object(sys, 'argv', test_args):
+        args = client.parse_args()
+        assert args.gauges == True
+
+def test_gauges_unset():
+    test_args = ['client.py']
+    with patch.object(sys, 'argv', test_args):
+        args = client.parse_args()
+        assert args.gauges == False
+
 ## Test functions
 
 # establish_connection()
@@ -126,6 +153,15 @@ def test_send_heartbeat_success(mock_logging_info, patched_time, mock_socket):
     mock_logging_info.assert_called_once_with(expected_msg)
     mock_socket.sendall.assert_called_once_with(expected_msg.encode('utf-8'))
 
+def test_send_heartbeat_with_payload(mock_logging_info, patched_time,
+    mock_socket):
+    client.send_heartbeat(mock_socket, 5, "load=0.5,queue=12")
+
+    expected_msg = ("Sequence #5: Sending heartbeat at 1752000000.6510. "
+        "Gauges load=0.5,queue=12. ")
+    mock_logging_info.assert_called_once_with(expected_msg)
+    mock_socket.sendall.assert_called_once_with(expected_msg.encode('utf-8'))
+
 def test_send_heartbeat_broken_pipe(mock_logging_error, mock_sys_exit,
     patched_time, mock_socket):
     mock_socket.sendall.side_effect = BrokenPipeError("pipe broke")
@@ -136,10 +172,118 @@ def test_send_heartbeat_broken_pipe(mock_logging_error, mock_sys_exit,
     mock_sys_exit.assert_called_once_with(1)
 
 
+# encode_gauges()
+def test_encode_gauges_all_new():
+    gauges = {'load': 0.5, 'mem': 1024}
+    assert client.encode_gauges(gauges, {}) == "load=0.5,mem=1024"
+
+def test_encode_gauges_only_changed():
+    gauges = {'load': 0.5, 'mem': 2048, 'queue': 3}
+    last_gauges = {'load': 0.5, 'mem': 1024, 'queue': 3}
+    assert client.encode_gauges(gauges, last_gauges) == "mem=2048"
+
+def test_encode_gauges_unchanged():
+    gauges = {'load': 0.5}
+    assert client.encode_gauges(gauges, dict(gauges)) == ""
+
+def test_encode_gauges_invalid_name():
+    with pytest.raises(ValueError, match="not a valid identifier"):
+        client.encode_gauges({'queue depth': 3}, {})
+
+def test_encode_gauges_invalid_value():
+    with pytest.raises(ValueError):
+        client.encode_gauges({'load': 'high'}, {})
+
+def test_encode_gauges_bool_value():
+    with pytest.raises(ValueError, match="not a number"):
+        client.encode_gauges({'healthy': True}, {})
+
+# collect_system_gauges()
+@patch("client.os.getloadavg", return_value=(0.123, 0.2, 0.3))
+def test_collect_system_gauges(mock_loadavg):
+    assert client.collect_system_gauges() == {'load_1m': 0.12}
+
+@patch("client.os.getloadavg", side_effect=OSError("unavailable"))
+def test_collect_system_gauges_unavailable(mock_loadavg):
+    assert client.collect_system_gauges() == {}
+
+# get_interval()
+def test_get_interval_valid():
+    assert client.get_interval("Interval: 2000. ") == 2000
+
+def test_get_interval_uses_latest():
+    assert client.get_interval("Interval: 2000. Interval: 500. ") == 500
+
+def test_get_interval_missing():
+    assert client.get_interval("Something else. ") is None
+
+def test_get_interval_incomplete():
+    assert client.get_interval("Interval: 20") is None
+
+def test_get_interval_ignores_incomplete_latest():
+    assert client.get_interval("Interval: 500. Interval: 20") == 500
+
+# check_interval_update()
+@patch("client.select.select")
+def test_check_interval_update_no_data(mock_select, mock_socket):
+    mock_select.return_value = ([], [], [])
+
+    assert client.check_interval_update(mock_socket, 1000) == (1000, '')
+    mock_socket.recv.assert_not_called()
+
+@patch("client.select.select")
+def test_check_interval_update_changed(mock_select, mock_logging_info,
+    mock_socket):
+    mock_select.return_value = ([mock_socket], [], [])
+    mock_socket.recv.return_value = b"Interval: 4000. "
+
+    assert client.check_interval_update(mock_socket, 1000) == (4000, '')
+    mock_logging_info.assert_called_once_with(
+        "Server changed heartbeat interval from 1000ms to 4000ms")
+
+@patch("client.select.select")
+def test_check_interval_update_invalid(mock_select, mock_socket):
+    mock_select.return_value = ([mock_socket], [], [])
+    mock_socket.recv.return_value = b"Interval: soon. "
+
+    assert client.check_interval_update(mock_socket, 1000) == (1000, '')
+
+@patch("client.select.select")
+def test_check_interval_update_split(mock_select, mock_socket):
+    mock_select.return_value = ([mock_socket], [], [])
+    mock_socket.recv.side_effect = [b"Interval: 40", b"00. "]
+
+    # Partial control message is kept until the rest arrives
+    interval, pending = client.check_interval_update(mock_socket, 1000)
+    assert (interval, pending) == (1000, "Interval: 40")
+    assert client.check_interval_update(mock_socket, interval,
+        pending) == (4000, '')
+
+@patch("client.select.select")
+def test_check_interval_update_pending_limit(mock_select, mock_socket):
+    mock_select.return_value = ([mock_socket], [], [])
+    mock_socket.recv.return_value = b"x" * 1024
+
+    interval, pending = client.check_interval_update(mock_socket, 1000,
+        "x" * 1024)
+    assert (interval, pending) == (1000, '')
+
+@patch("client.select.select")
+def test_check_interval_update_connection_reset(mock_select, mock_socket):
+    mock_select.return_value = ([mock_socket], [], [])
+    mock_socket.recv.side_effect = ConnectionResetError("reset")
+
+    # Left to send_heartbeat() to report
+    assert client.check_interval_update(mock_socket, 1000) == (1000, '')
+
+
 # start_heartbeat_loop()
+@patch("client.check_interval_update",
+    side_effect=lambda s, interval, pending: (interval, pending))
 @patch("client.send_heartbeat")
 @patch("client.time.sleep", return_value=None)
-def test_heartbeat_loop_runs_three_times(mock_sleep, mock_send, mock_socket):
+def test_heartbeat_loop_runs_three_times(mock_sleep, mock_send, mock_check,
+    mock_socket):
     interval = 100  # milliseconds
 
     # Stop after 3 heartbeats using side effect
@@ -160,3 +304,47 @@ def test_heartbeat_loop_runs_three_times(mock_sleep, mock_send, mock_socket):
 
     # Check time.sleep was called three times
     assert mock_sleep.call_count == 3
+
+@patch("client.check_interval_update",
+    side_effect=[(100, ''), (2000, ''), (2000, '')])
+@patch("client.send_heartbeat")
+@patch("client.time.sleep", return_value=None)
+def test_heartbeat_loop_applies_interval_update(mock_sleep, mock_send,
+    mock_check, mock_socket):
+    def side_effect(*args, **kwargs):
+        if mock_sleep.call_count == 3:
+            raise SystemExit()
+
+    mock_sleep.side_effect = side_effect
+
+    with pytest.raises(SystemExit):
+        client.start_heartbeat_loop(mock_socket, 100)
+
+    # New interval is applied without reconnecting
+    mock_check.assert_any_call(mock_socket, 100, '')
+    mock_check.assert_any_call(mock_socket, 2000, '')
+    mock_sleep.assert_any_call(0.1)
+    mock_sleep.assert_called_with(2.0)
+    mock_socket.connect.assert_not_called()
+
+@patch("client.check_interval_update",
+    side_effect=lambda s, interval, pending: (interval, pending))
+@patch("client.send_heartbeat")
+@patch("client.time.sleep", return_value=None)
+def test_heartbeat_loop_sends_gauge_deltas(mock_sleep, mock_send, mock_check,
+    mock_socket):
+    def side_effect(*args, **kwargs):
+        if mock_sleep.call_count == 3:
+            raise SystemExit()
+
+    mock_sleep.side_effect = side_effect
+    collect_gauges = MagicMock(side_effect=[{'load': 0.5, 'queue': 1},
+        {'load': 0.5, 'queue': 1}, {'load': 0.5, 'queue': 4}])
+
+    with pytest.raises(SystemExit):
+        client.start_heartbeat_loop(mock_socket, 100, collect_gauges)
+
+    # Unchanged gauges are not sent again
+    mock_send.assert_any_call(mock_socket, 1, "load=0.5,queue=1")
+    mock_send.assert_any_call(mock_socket, 2, "")
+    mock_send.assert_any_call(mock_socket, 3, "queue=4")
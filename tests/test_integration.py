@@ -114,6 +114,234 @@ def test_integration_custom_params(free_tcp_port):
     assert "WARNING" not in server_output
     assert "ERROR" not in server_output
 
+# Gauges piggybacked on heartbeats
+def test_integration_gauges(free_tcp_port):
+    port = str(free_tcp_port)
+    # Run server
+    server_proc = subprocess.Popen([sys.executable, 'server.py', '-p', port,
+        '-d'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    time.sleep(0.5)  # Wait for server to start
+
+    # Run client
+    client_proc = subprocess.Popen([sys.executable, 'client.py', '-p', port,
+        '-i', '100', '-g'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    time.sleep(1)  # Let some heartbeats be transmitted
+
+    server_output = end_subp_gather_output(server_proc)
+    client_output = end_subp_gather_output(client_proc, terminate=False)
+
+    # First heartbeat carries the full set of gauges
+    assert "Sequence #1: Sending heartbeat at" in client_output
+    assert "Gauges load_1m=" in client_output
+
+    # Server decoded them into the client's table
+    assert "Gauges for ('127.0.0.1'" in server_output
+    assert "'load_1m'" in server_output
+
+    # Verify no errors
+    assert "WARNING" not in server_output
+    assert "ERROR" not in server_output
+
+# Kernel receive timestamps
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+    reason="Kernel timestamps are only supported on Linux")
+def test_integration_kernel_timestamps(free_tcp_port):
+    port = str(free_tcp_port)
+
+    server_proc = subprocess.Popen([sys.executable, 'server.py', '-p', port,
+        '-d', '-k'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    time.sleep(0.5)  # Wait for server to start
+
+    client_proc = subprocess.Popen([sys.executable, 'client.py', '-p', port,
+        '-i', '100'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    time.sleep(1)  # Let some heartbeats be transmitted
+
+    server_output = end_subp_gather_output(server_proc)
+    end_subp_gather_output(client_proc, terminate=False)
+
+    assert "Sequence #2" in server_output
+    assert "to be received." in server_output
+
+    # Kernel timestamps were enabled without falling back
+    assert "WARNING" not in server_output
+    assert "ERROR" not in server_output
+
+# Rollups queried over the local query port
+def test_integration_rollups(free_tcp_port):
+    import json
+    port = str(free_tcp_port)
+
+    # Dynamically pick another free port for queries
+    s = socket.socket()
+    s.bind(('', 0))
+    query_port = s.getsockname()[1]
+    s.close()
+
+    server_proc = subprocess.Popen([sys.executable, 'server.py', '-p', port,
+        '-q', str(query_port)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    time.sleep(0.5)  # Wait for server to start
+
+    client_proc = subprocess.Popen([sys.executable, 'client.py', '-p', port,
+        '-i', '50'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    time.sleep(1.5)  # Let some heartbeats be transmitted
+
+    with socket.create_connection(('localhost', query_port), timeout=5) as s, \
+        s.makefile('rw', encoding='utf-8') as f:
+        f.write('{"resolution": "minute"}\n')
+        f.flush()
+        result = json.loads(f.readline())
+
+    server_output = end_subp_gather_output(server_proc)
+    end_subp_gather_output(client_proc, terminate=False)
+
+    # One client, with all of its heartbeats so far in the current minute(s)
+    [(client, buckets)] = result.items()
+    assert client.startswith('127.0.0.1:')
+    assert sum(bucket['count'] for bucket in buckets) >= 10
+    assert all(bucket['missed'] == 0 for bucket in buckets)
+
+    assert "ERROR" not in server_output
+
+# Shared memory transport for local clients
+def test_integration_shm():
+    pytest.importorskip("shm")
+    table_name = f"hb_integration_{os.getpid()}"
+
+    server_proc = subprocess.Popen([sys.executable, 'server.py', '-p', '0',
+        '-d', '--shm', table_name], stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+
+    time.sleep(0.5)  # Wait for server to create the table
+
+    client_procs = [subprocess.Popen([sys.executable, 'client.py', '--shm',
+        table_name, '-i', '50'], stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE) for _ in range(3)]
+
+    time.sleep(2)  # Let some heartbeats be written
+
+    for client_proc in client_procs:
+        client_output = end_subp_gather_output(client_proc)
+        assert "Attached to shared memory table" in client_output
+
+    time.sleep(0.5)  # Let the server see the clients detach
+    server_output = end_subp_gather_output(server_proc)
+
+    # No client left, so the table is removed with the server
+    import shm
+    with pytest.raises(FileNotFoundError):
+        shm.HeartbeatTable.attach(table_name)
+    assert not os.path.exists(shm.lock_path(table_name))
+
+    for slot in range(3):
+        assert f"attached to shared memory slot {slot}" in server_output
+        assert f"detached from shared memory slot {slot}" in server_output
+    assert "to be received." in server_output
+
+    # Verify no errors
+    assert "WARNING" not in server_output
+    assert "ERROR" not in server_output
+
+# Shared memory client killed, then server restarted
+# Verifies:
+#   - Server reports a client that exits without freeing its slot
+#   - Restarted server does not report a running client's history as missed
+def test_integration_shm_client_killed_and_server_restart():
+    shm = pytest.importorskip("shm")
+    table_name = f"hb_integration_{os.getpid()}_restart"
+
+    server_proc = subprocess.Popen([sys.executable, 'server.py', '-p', '0',
+        '--shm', table_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    time.sleep(0.5)  # Wait for server to create the table
+
+    client_procs = [subprocess.Popen([sys.executable, 'client.py', '--shm',
+        table_name, '-i', '20'], stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE) for _ in range(2)]
+    time.sleep(1)
+
+    client_procs[0].kill()  # No chance to free its slot
+    client_procs[0].wait()  # Reaped, as by a supervisor
+    time.sleep(0.5)
+
+    # Table is kept for the client still running
+    server_output = end_subp_gather_output(server_proc)
+    assert "exited without detaching from shared memory slot" in server_output
+    assert "Leaving shared memory table" in server_output
+
+    server_proc = subprocess.Popen([sys.executable, 'server.py', '-p', '0',
+        '--shm', table_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    time.sleep(1)
+
+    table = shm.HeartbeatTable.attach(table_name)
+    assert max(table.seq_nums) >= 50
+    table.close()
+
+    end_subp_gather_output(client_procs[0], terminate=False)
+    end_subp_gather_output(client_procs[1])
+    time.sleep(0.5)
+    server_output = end_subp_gather_output(server_proc)
+
+    assert "Missed heartbeat" not in server_output
+    with pytest.raises(FileNotFoundError):
+        shm.HeartbeatTable.attach(table_name)
+
+# Anomaly detection enabled
+def test_integration_anomaly(free_tcp_port):
+    pytest.importorskip("numpy")
+    port = str(free_tcp_port)
+
+    server_proc = subprocess.Popen([sys.executable, 'server.py', '-p', port,
+        '--anomaly'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    time.sleep(0.5)  # Wait for server to start
+
+    client_proc = subprocess.Popen([sys.executable, 'client.py', '-p', port,
+        '-i', '100'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    time.sleep(2.5)  # Let a few anomaly sweeps run
+
+    server_output = end_subp_gather_output(server_proc)
+    end_subp_gather_output(client_proc, terminate=False)
+
+    assert "Sequence #10" in server_output
+
+    # Steady client during warmup should not be flagged
+    assert "WARNING" not in server_output
+    assert "ERROR" not in server_output
+
+# Adaptive interval
+# Verifies:
+#   - A client whose heartbeat arrives late is asked for a shorter interval
+def test_integration_adaptive_suspected(free_tcp_port):
+    port = free_tcp_port
+
+    server_proc = subprocess.Popen([sys.executable, 'server.py', '-p',
+        str(port), '--adaptive', '--min-interval', '50'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    time.sleep(0.5)  # Wait for server to start
+
+    with socket.create_connection(('localhost', port)) as s:
+        for sequence_num in range(1, 4):
+            s.sendall(client.format_heartbeat(sequence_num).encode('utf-8'))
+            time.sleep(0.2)
+
+        time.sleep(0.4)  # Heartbeat 4 is late, 3 intervals after the last one
+        s.sendall(client.format_heartbeat(4).encode('utf-8'))
+
+        s.settimeout(5)
+        data = s.recv(1024).decode('utf-8')
+
+    server_output = end_subp_gather_output(server_proc)
+
+    assert client.get_interval(data) == 100
+    assert "Requesting heartbeat interval of 100ms" in server_output
+
 # Test with a remote host
 def test_client_connect_remote_host():
     host = 'google.com'
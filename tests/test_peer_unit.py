@@ -0,0 +1,251 @@
+import time
+import socket
+import pytest
+
+# Local imports
+import peer
+import server
+
+
+# Fixtures
+@pytest.fixture
+def node():
+    node = peer.PeerNode(interval=50)
+    node.name = '127.0.0.1:7001'
+    return node
+
+@pytest.fixture
+def cluster():
+    nodes = []
+
+    def start(n_nodes, interval=50):
+        first = peer.PeerNode(interval=interval)
+        first.start()
+        nodes.append(first)
+        for _ in range(n_nodes - 1):
+            node = peer.PeerNode(seeds=[first.name], interval=interval)
+            node.start()
+            nodes.append(node)
+
+        return nodes
+
+    yield start
+
+    for node in nodes:
+        node.stop(timeout=5)
+
+
+# Helpers
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+
+    return condition()
+
+
+## Test normal operation
+
+def test_format_message_is_heartbeat():
+    data = peer.format_message(12, peer.PING, '127.0.0.1:7001')
+
+    assert data.startswith("Sequence #12: Sending heartbeat at ")
+    assert server.get_seq_num(data) == 12
+    assert server.count_heartbeats(data) == 1
+
+def test_parse_message():
+    updates = [('127.0.0.1:7002', peer.SUSPECT, 3),
+        ('127.0.0.1:7003', peer.ALIVE, 0)]
+    data = peer.format_message(5, peer.PING_REQ, '127.0.0.1:7001',
+        '127.0.0.1:7002', updates)
+
+    seq_num, time_sent, kind, sender, target, parsed = peer.parse_message(data)
+
+    assert seq_num == 5
+    assert abs(time_sent - time.time()) < 5
+    assert kind == peer.PING_REQ
+    assert sender == '127.0.0.1:7001'
+    assert target == '127.0.0.1:7002'
+    assert parsed == updates
+
+def test_parse_message_without_members():
+    data = peer.format_message(1, peer.ACK, '127.0.0.1:7001')
+    assert peer.parse_message(data)[2:] == (peer.ACK, '127.0.0.1:7001', None,
+        [])
+
+def test_overrides():
+    # Alive refutes suspicion only with a higher incarnation
+    assert peer.overrides((peer.ALIVE, 2), (peer.SUSPECT, 1))
+    assert not peer.overrides((peer.ALIVE, 1), (peer.SUSPECT, 1))
+    # Suspicion overrides alive of the same incarnation
+    assert peer.overrides((peer.SUSPECT, 1), (peer.ALIVE, 1))
+    assert not peer.overrides((peer.SUSPECT, 1), (peer.SUSPECT, 1))
+    # Dead overrides anything but dead, and only a rejoin undoes it
+    assert peer.overrides((peer.DEAD, 0), (peer.ALIVE, 5))
+    assert not peer.overrides((peer.SUSPECT, 9), (peer.DEAD, 0))
+    assert peer.overrides((peer.ALIVE, 1), (peer.DEAD, 0))
+    assert peer.overrides((peer.SUSPECT, 0), None)
+
+def test_refutes_own_suspicion(node):
+    node._apply(node.name, peer.SUSPECT, 0)
+
+    assert node.incarnation == 1
+    assert node.name not in node.members
+    assert node._piggyback(1000) == [(node.name, peer.ALIVE, 1)]
+
+def test_suspect_times_out_to_dead(node):
+    node._apply('127.0.0.1:7002', peer.ALIVE, 0)
+    node._apply('127.0.0.1:7002', peer.SUSPECT, 0)
+    assert node.member_status('127.0.0.1:7002') == peer.SUSPECT
+
+    node._check_timeouts(time.monotonic() + 60)
+    assert node.member_status('127.0.0.1:7002') == peer.DEAD
+
+def test_dead_member_is_forgotten(node):
+    node._apply('127.0.0.1:7002', peer.DEAD, 0)
+    node._check_timeouts(time.monotonic())
+    assert node.member_status('127.0.0.1:7002') == peer.DEAD
+
+    node._check_timeouts(time.monotonic() + 60)
+    assert node.member_status('127.0.0.1:7002') is None
+    assert node._dead == {}
+
+def test_sync_includes_joining_node(node):
+    sent = []
+    node._send = lambda *args, **kwargs: sent.append(kwargs['updates'])
+    node._apply('127.0.0.1:7002', peer.DEAD, 3)
+
+    node._send_sync('127.0.0.1:7002', 1)
+
+    # So that a restarted node learns it was declared dead
+    assert ('127.0.0.1:7002', peer.DEAD, 3) in sent[0]
+
+def test_rejoin_after_declared_dead(node):
+    node._apply(node.name, peer.DEAD, 3, gossip=False)
+
+    assert node.incarnation == 4
+    assert node._piggyback(1000) == [(node.name, peer.ALIVE, 4)]
+
+def test_sync_is_not_gossiped(node):
+    data = peer.format_message(1, peer.SYNC, '127.0.0.1:7002',
+        updates=[('127.0.0.1:7002', peer.ALIVE, 0),
+            ('127.0.0.1:7003', peer.ALIVE, 0)])
+    node._handle(data)
+
+    assert node.alive_members() == {'127.0.0.1:7002', '127.0.0.1:7003'}
+    assert node._piggyback(1000) == []
+
+def test_piggyback_is_bounded(node):
+    for port in range(7002, 7102):
+        node._apply(f'127.0.0.1:{port}', peer.ALIVE, 0)
+
+    # Message size does not grow with the cluster
+    assert len(node._piggyback(peer.MAX_DATAGRAM_SIZE)) == node.max_piggyback
+    assert len(node._piggyback(60)) == 2
+
+    # Each update is only gossiped a limited number of times
+    limit = peer.scaled_limit(node.retransmit_mult, len(node.members))
+    for _ in range(limit * 100 // node.max_piggyback):
+        node._piggyback(peer.MAX_DATAGRAM_SIZE)
+    assert node._piggyback(peer.MAX_DATAGRAM_SIZE) == []
+
+def test_piggyback_least_sent_first(node):
+    node._apply('127.0.0.1:7002', peer.ALIVE, 0)
+    node._piggyback(peer.MAX_DATAGRAM_SIZE)
+    node._apply('127.0.0.1:7003', peer.ALIVE, 0)
+
+    assert node._piggyback(30) == [('127.0.0.1:7003', peer.ALIVE, 0)]
+
+    # A newer update about a node replaces the one being gossiped
+    node._apply('127.0.0.1:7002', peer.SUSPECT, 0)
+    assert node._piggyback(30) == [('127.0.0.1:7002', peer.SUSPECT, 0)]
+
+def test_cluster_converges_and_detects_failure(cluster):
+    nodes = cluster(24)
+    names = {node.name for node in nodes}
+
+    assert wait_for(lambda: all(node.alive_members() == names - {node.name}
+        for node in nodes))
+
+    victim = nodes.pop()
+    victim.stop(timeout=5)
+
+    assert wait_for(lambda: all(victim.name not in node.alive_members()
+        for node in nodes))
+
+    # No false positives among the nodes still running
+    for node in nodes:
+        assert node.alive_members() == names - {node.name, victim.name}
+
+def test_restarted_node_rejoins(cluster):
+    nodes = cluster(6)
+    names = {node.name for node in nodes}
+    assert wait_for(lambda: all(node.alive_members() == names - {node.name}
+        for node in nodes))
+
+    victim = nodes.pop()
+    victim.stop(timeout=5)
+    assert wait_for(lambda: all(node.member_status(victim.name) == peer.DEAD
+        for node in nodes))
+
+    # Same address, starting again from incarnation 0
+    restarted = peer.PeerNode(port=peer.node_addr(victim.name)[1],
+        seeds=[nodes[0].name], interval=50)
+    restarted.start()
+    nodes.append(restarted)
+
+    assert wait_for(lambda: all(node.alive_members() == names - {node.name}
+        for node in nodes))
+    assert restarted.incarnation > 0
+
+def test_message_load_is_constant(cluster):
+    nodes = cluster(32)
+    names = {node.name for node in nodes}
+    assert wait_for(lambda: all(node.alive_members() == names - {node.name}
+        for node in nodes))
+
+    before = [(node.periods, node.messages_sent + node.messages_received)
+        for node in nodes]
+    time.sleep(1)
+
+    # Ping and ack sent and received per period, plus the occasional
+    # indirect probe. Independent of the cluster size once joined
+    for node, (periods, messages) in zip(nodes, before):
+        load = (node.messages_sent + node.messages_received - messages) \
+            / (node.periods - periods)
+        assert load < 8
+
+def test_simulate():
+    report = peer.simulate(8, interval=50, timeout_s=10)
+
+    assert report['join_s'] is not None
+    assert report['detect_s'] is not None
+    assert 0 < report['messages_per_period_mean'] < 8
+
+
+## Test failing cases
+
+def test_parse_message_unknown_kind():
+    with pytest.raises(ValueError):
+        peer.parse_message("Sequence #1: Sending heartbeat at 1.0. "
+            "Hello from 127.0.0.1:7001. ")
+
+def test_parse_message_bad_status():
+    data = peer.format_message(1, peer.PING, '127.0.0.1:7001',
+        updates=[('127.0.0.1:7002', 'gone', 0)])
+    with pytest.raises(ValueError):
+        peer.parse_message(data)
+
+def test_malformed_message_is_ignored(cluster):
+    nodes = cluster(2)
+    assert wait_for(lambda: len(nodes[0].alive_members()) == 1)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.sendto(b'garbage', peer.node_addr(nodes[0].name))
+        s.sendto(b'\xff\xfe', peer.node_addr(nodes[0].name))
+
+    time.sleep(0.2)
+    assert nodes[0]._thread.is_alive()
+    assert nodes[0].alive_members() == {nodes[1].name}
@@ -0,0 +1,199 @@
+import json
+import time
+import socket
+import pytest
+import threading
+
+# Local import
+import rollups
+
+
+# Fixture
+@pytest.fixture
+def free_tcp_port():
+    s = socket.socket()
+    s.bind(('', 0))
+    addr, port = s.getsockname()
+    s.close()
+    return port
+
+
+## Test histogram
+
+def test_histogram_bin_bounds():
+    assert rollups.histogram_bin(0) == 0
+    assert rollups.histogram_bin(-5) == 0  # Clock skew between hosts
+    assert rollups.histogram_bin(1e9) == rollups.HISTOGRAM_BINS - 1
+
+def test_histogram_bin_edges():
+    for i, edge in enumerate(rollups.HISTOGRAM_EDGES[:-1]):
+        assert rollups.histogram_bin(edge * 0.999) == i
+        assert rollups.histogram_bin(edge) == i + 1
+
+
+## Test RingBuffer
+
+def test_ring_buffer_single_bucket():
+    ring = rollups.RingBuffer(60, 4)
+    for delay_ms in (2.0, 1.0, 3.0):
+        ring.record(1752000000.0, delay_ms)
+    ring.record(1752000010.0, 4.0, missed=2)
+
+    [bucket] = ring.query()
+
+    assert bucket['start'] == 1752000000 // 60 * 60
+    assert bucket['count'] == 4
+    assert bucket['missed'] == 2
+    assert bucket['min_ms'] == 1.0
+    assert bucket['mean_ms'] == 2.5
+    assert bucket['max_ms'] == 4.0
+    assert 3.0 <= bucket['p99_ms'] <= 4.0
+
+def test_ring_buffer_wraps_around():
+    ring = rollups.RingBuffer(1, 3)
+    for second in range(5):
+        ring.record(1752000000.0 + second, float(second))
+
+    buckets = ring.query()
+
+    # Only the last three seconds are kept, oldest first
+    assert [bucket['start'] for bucket in buckets] == [1752000002,
+        1752000003, 1752000004]
+    assert [bucket['count'] for bucket in buckets] == [1, 1, 1]
+    assert buckets[0]['min_ms'] == 2.0
+
+def test_ring_buffer_query_range():
+    ring = rollups.RingBuffer(1, 10)
+    for second in range(10):
+        ring.record(1752000000.5 + second, 1.0)
+
+    buckets = ring.query(start=1752000003.5, end=1752000006)
+
+    assert [bucket['start'] for bucket in buckets] == [1752000003,
+        1752000004, 1752000005]
+
+def test_ring_buffer_p99():
+    ring = rollups.RingBuffer(3600, 1)
+    for _ in range(990):
+        ring.record(1752000000.0, 1.0)
+    for _ in range(10):
+        ring.record(1752000000.0, 200.0)
+
+    [bucket] = ring.query()
+
+    # Within one histogram bin of the real value
+    assert 1.0 <= bucket['p99_ms'] <= 1.0 * rollups.HISTOGRAM_RATIO
+    assert bucket['max_ms'] == 200.0
+
+def test_ring_buffer_p99_beyond_histogram():
+    ring = rollups.RingBuffer(3600, 1)
+    for i in range(100):
+        ring.record(1752000000.0, 700.0 + i * 50)  # 700ms to 5650ms
+
+    [bucket] = ring.query()
+
+    # Above the histogram's range, so reported as the maximum rather than
+    # the edge of the last bin
+    assert bucket['p99_ms'] == 5650.0
+
+def test_ring_buffer_empty():
+    assert rollups.RingBuffer(1, 10).query() == []
+
+
+## Test Rollups
+
+def test_rollups_all_resolutions():
+    history = rollups.Rollups()
+    history.record('a', 1752000000.0, 1.0)
+    history.record('a', 1752000001.0, 3.0, missed=1)
+
+    seconds = history.query(['a'], 'second')['a']
+    minutes = history.query(['a'], 'minute')['a']
+    hours = history.query(['a'], 'hour')['a']
+
+    assert [bucket['count'] for bucket in seconds] == [1, 1]
+    assert minutes[0]['count'] == hours[0]['count'] == 2
+    assert minutes[0]['missed'] == hours[0]['missed'] == 1
+    assert minutes[0]['mean_ms'] == 2.0
+
+def test_rollups_many_clients():
+    history = rollups.Rollups()
+    for client in ('a', 'b', 'c'):
+        history.record(client, 1752000000.0, 1.0)
+
+    assert set(history.query()) == {'a', 'b', 'c'}
+    assert set(history.query(['a', 'c', 'unknown'])) == {'a', 'c'}
+    assert history.clients() == ['a', 'b', 'c']
+
+def test_rollups_unknown_resolution():
+    with pytest.raises(ValueError, match="Unknown resolution"):
+        rollups.Rollups().query(resolution='fortnight')
+
+def test_rollups_evicts_least_recent_client():
+    history = rollups.Rollups(max_clients=2)
+    history.record('a', 1752000000.0, 1.0)
+    history.record('b', 1752000000.0, 1.0)
+    history.record('a', 1752000001.0, 1.0)
+    history.record('c', 1752000001.0, 1.0)
+
+    assert history.clients() == ['a', 'c']
+
+def test_rollups_memory_bounded():
+    history = rollups.Rollups(seconds=60, minutes=60, hours=24,
+        max_clients=100)
+
+    assert history.bytes_per_client == \
+        144 * rollups.RingBuffer.bytes_per_bucket()
+    assert history.max_bytes == 100 * history.bytes_per_client
+
+    # Buffers do not grow with the number of heartbeats
+    for i in range(10000):
+        history.record('a', 1752000000.0 + i * 0.01, 1.0)
+    ring = history._clients['a']['second']
+    assert len(ring.counts) == 60
+    assert len(ring.histograms) == 60 * rollups.HISTOGRAM_BINS
+
+
+## Test local query interface
+
+def test_handle_query():
+    history = rollups.Rollups()
+    history.record('127.0.0.1:40000', 1752000000.0, 1.0)
+
+    result = json.loads(rollups.handle_query(history,
+        '{"clients": ["127.0.0.1:40000"], "resolution": "hour"}'))
+
+    assert result['127.0.0.1:40000'][0]['count'] == 1
+
+def test_handle_query_single_client():
+    history = rollups.Rollups()
+    history.record('a', 1752000000.0, 1.0)
+    history.record('b', 1752000000.0, 1.0)
+
+    result = json.loads(rollups.handle_query(history, '{"clients": "a"}'))
+
+    assert list(result) == ['a']
+
+def test_handle_query_invalid():
+    history = rollups.Rollups()
+
+    assert 'error' in json.loads(rollups.handle_query(history, 'not json'))
+    assert 'error' in json.loads(rollups.handle_query(history, '[1, 2]'))
+    assert 'error' in json.loads(rollups.handle_query(history,
+        '{"resolution": "fortnight"}'))
+
+def test_serve_queries(free_tcp_port):
+    history = rollups.Rollups()
+    history.record('a', time.time(), 2.0)
+
+    threading.Thread(target=rollups.serve_queries,
+        args=(history, free_tcp_port), daemon=True).start()
+    time.sleep(0.2)  # Let listener start
+
+    with socket.create_connection(('localhost', free_tcp_port), timeout=5) \
+        as s, s.makefile('rw', encoding='utf-8') as f:
+        f.write('{"resolution": "second"}\n')
+        f.flush()
+        result = json.loads(f.readline())
+
+    assert result['a'][0]['max_ms'] == 2.0
@@ -0,0 +1,288 @@
+import time
+import socket
+import pytest
+import threading
+
+# Local imports
+import server
+import sender
+
+
+# Fixtures
+@pytest.fixture
+def loop():
+    loop = sender.SenderLoop()
+    yield loop
+    loop.close(timeout=5)
+
+@pytest.fixture
+def listener():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('localhost', 0))
+    s.listen(128)
+    s.settimeout(5)
+    yield s
+    s.close()
+
+@pytest.fixture
+def fast_reconnect(monkeypatch):
+    monkeypatch.setattr(sender, 'RECONNECT_INTERVAL_S', 0.05)
+
+
+# Helpers
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+
+    return condition()
+
+def recv_until(connection, substr, timeout=5):
+    connection.settimeout(timeout)
+    data = ''
+    while substr not in data:
+        chunk = connection.recv(1024)
+        if not chunk:
+            break
+        data += chunk.decode('utf-8')
+
+    return data
+
+
+## Test normal operation
+
+def test_sender_start_connects(loop, listener):
+    connected = []
+    hb_sender = sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=20, on_connect=connected.append, loop=loop)
+
+    start = time.perf_counter()
+    hb_sender.start()
+    assert time.perf_counter() - start < 0.1  # Does not wait to connect
+
+    connection, client_addr = listener.accept()
+    with connection:
+        data = recv_until(connection, "Sequence #3")
+
+        assert server.get_seq_num(data) == 1
+        assert wait_for(lambda: connected == [hb_sender])
+        assert hb_sender.connected
+
+def test_sender_stop(loop, listener):
+    disconnected = []
+    hb_sender = sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=20, loop=loop,
+        on_disconnect=lambda s, error: disconnected.append(error))
+    hb_sender.start()
+
+    connection, client_addr = listener.accept()
+    with connection:
+        recv_until(connection, "Sequence #1")
+        hb_sender.stop()
+
+        assert wait_for(lambda: disconnected == [None])
+        assert hb_sender.state == sender.STOPPED
+
+        # Connection is closed once stopped
+        recv_until(connection, "never sent")
+        assert connection.recv(1024) == b''
+
+def test_sender_gauges(loop, listener):
+    hb_sender = sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=20, loop=loop, collect_gauges=lambda: {'queue': 3})
+    hb_sender.start()
+
+    connection, client_addr = listener.accept()
+    with connection:
+        data = recv_until(connection, "Sequence #3")
+
+        # Unchanged gauges are only sent once
+        assert server.get_gauges(data) == {'queue': 3.0}
+        assert data.count("Gauges") == 1
+
+def test_sender_interval_update(loop, listener):
+    hb_sender = sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=1000, loop=loop)
+    hb_sender.start()
+
+    connection, client_addr = listener.accept()
+    with connection:
+        recv_until(connection, "Sequence #1")
+        server.send_interval_update(connection, 20)
+
+        assert wait_for(lambda: hb_sender.interval == 20)
+        recv_until(connection, "Sequence #5", timeout=2)
+
+def test_sender_interval_update_split(loop, listener):
+    hb_sender = sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=1000, loop=loop)
+    hb_sender.start()
+
+    connection, client_addr = listener.accept()
+    with connection:
+        recv_until(connection, "Sequence #1")
+        connection.sendall(b"Interval: 2")
+        time.sleep(0.1)
+        connection.sendall(b"0. ")
+
+        assert wait_for(lambda: hb_sender.interval == 20)
+
+def test_senders_share_one_thread(loop, listener):
+    threads_before = threading.active_count()
+    senders = [sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=50, loop=loop) for _ in range(20)]
+
+    for hb_sender in senders:
+        hb_sender.start()
+
+    connections = [listener.accept()[0] for _ in senders]
+    assert wait_for(lambda: all(s.connected for s in senders))
+    assert wait_for(lambda: all(s.beats_sent >= 2 for s in senders))
+
+    # Resolver threads are gone once connected
+    assert wait_for(lambda: threading.active_count() == threads_before + 1)
+
+    # Overhead per beat is microseconds in practice. Kept loose to avoid
+    # flakiness on slow runners
+    for hb_sender in senders:
+        assert 0 < hb_sender.mean_overhead_us < 10000
+
+    for connection in connections:
+        connection.close()
+
+def test_sender_default_loop():
+    assert sender.get_default_loop() is sender.get_default_loop()
+    assert sender.HeartbeatSender().loop is sender.get_default_loop()
+
+def test_sender_ipv4_when_localhost_is_ipv6_first(loop, listener,
+    monkeypatch):
+    getaddrinfo = socket.getaddrinfo
+
+    def ipv6_first_getaddrinfo(host, port, family=0, *args, **kwargs):
+        # As on macOS and Fedora, where localhost resolves to ::1 first
+        addr_info = getaddrinfo(host, port, socket.AF_INET, *args, **kwargs)
+        if family == socket.AF_INET:
+            return addr_info
+        return [(socket.AF_INET6, socket.SOCK_STREAM, 6, '',
+            ('::1', port, 0, 0))] + addr_info
+
+    monkeypatch.setattr(sender.socket, 'getaddrinfo', ipv6_first_getaddrinfo)
+
+    hb_sender = sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=20, loop=loop)
+    hb_sender.start()
+
+    connection, client_addr = listener.accept()
+    with connection:
+        assert "Sequence #1" in recv_until(connection, "Sequence #1")
+
+
+## Test failing cases
+
+def test_sender_slow_lookup_does_not_block_others(loop, listener, monkeypatch):
+    getaddrinfo = socket.getaddrinfo
+
+    def slow_getaddrinfo(host, *args, **kwargs):
+        if host == 'slow.invalid':
+            time.sleep(1)
+            raise socket.gaierror("Name or service not known")
+        return getaddrinfo(host, *args, **kwargs)
+
+    monkeypatch.setattr(sender.socket, 'getaddrinfo', slow_getaddrinfo)
+
+    slow_sender = sender.HeartbeatSender('slow.invalid', 6510, interval=20,
+        loop=loop)
+    slow_sender.start()
+
+    start = time.monotonic()
+    hb_sender = sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=20, loop=loop)
+    hb_sender.start()
+
+    connection, client_addr = listener.accept()
+    with connection:
+        recv_until(connection, "Sequence #3")
+
+        assert time.monotonic() - start < 0.5
+        assert slow_sender.state == sender.CONNECTING
+
+def test_sender_server_not_running(loop, fast_reconnect):
+    # Pick a port nothing is listening on
+    s = socket.socket()
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+
+    connected = []
+    hb_sender = sender.HeartbeatSender('localhost', port, interval=20,
+        on_connect=connected.append, loop=loop)
+
+    # Must not raise or exit
+    hb_sender.start()
+
+    time.sleep(0.3)
+    assert not hb_sender.connected
+    assert connected == []
+
+def test_sender_reconnects(loop, listener, fast_reconnect):
+    events = []
+    hb_sender = sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=20, loop=loop,
+        on_connect=lambda s: events.append('connect'),
+        on_disconnect=lambda s, error: events.append(error))
+    hb_sender.start()
+
+    connection, client_addr = listener.accept()
+    recv_until(connection, "Sequence #2")
+    connection.close()  # Server drops the client
+
+    connection, client_addr = listener.accept()
+    with connection:
+        # Sequence numbers restart with the new connection
+        data = recv_until(connection, "Sequence #1")
+        assert server.get_seq_num(data) == 1
+
+    assert events[0] == 'connect'
+    assert isinstance(events[1], OSError)
+    assert wait_for(lambda: events[2] == 'connect')
+
+def test_sender_callback_error_does_not_stop_loop(loop, listener):
+    def on_connect(hb_sender):
+        raise RuntimeError("Host application bug")
+
+    hb_sender = sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=20, on_connect=on_connect, loop=loop)
+    hb_sender.start()
+
+    connection, client_addr = listener.accept()
+    with connection:
+        recv_until(connection, "Sequence #3")
+
+def test_sender_gauges_error_does_not_stop_beats(loop, listener):
+    def collect_gauges():
+        raise RuntimeError("Metrics unavailable")
+
+    hb_sender = sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=20, collect_gauges=collect_gauges, loop=loop)
+    hb_sender.start()
+
+    connection, client_addr = listener.accept()
+    with connection:
+        data = recv_until(connection, "Sequence #3")
+        assert "Gauges" not in data
+
+def test_sender_skips_beat_when_backed_up(loop, listener):
+    hb_sender = sender.HeartbeatSender('localhost', listener.getsockname()[1],
+        interval=1000, loop=loop)
+    hb_sender._out = b'pending'
+    hb_sender.state = sender.CONNECTED
+
+    hb_sender._beat()
+
+    # Heartbeats are never queued behind a slow connection, and skipping one
+    # leaves no gap for the server to take as lost heartbeats
+    assert hb_sender.beats_skipped == 1
+    assert hb_sender.beats_sent == 0
+    assert hb_sender.sequence_num == 0
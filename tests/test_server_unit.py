@@ -1,8 +1,9 @@
 import sys
 import random
+import socket
 import pytest
 
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 # Local import
 import server
@@ -59,6 +60,89 @@ def test_debug_logging_unset():
         args = server.parse_args()
         assert args.debug == False
 
+# Adaptive interval
+def test_adaptive_defaults():
+    test_args = ['server.py']
+    with patch.object(sys, 'argv', test_args):
+        args = server.parse_args()
+        assert args.adaptive == False
+        assert args.min_interval == 100
+        assert args.max_interval == 10000
+
+def test_adaptive_custom_bounds():
+    test_args = ['server.py', '-a', '--min-interval', '50',
+        '--max-interval', '5000']
+    with patch.object(sys, 'argv', test_args):
+        args = server.parse_args()
+        assert args.adaptive == True
+        assert args.min_interval == 50
+        assert args.max_interval == 5000
+
+def test_adaptive_invalid_bound():
+    test_args = ['server.py', '--max-interval', '0']
+    with patch.object(sys, 'argv', test_args):
+        with pytest.raises(SystemExit) as sysexit:
+            args = server.parse_args()
+
+        assert sysexit.value.code == 2
+
+# Anomaly detection
+def test_anomaly_set():
+    test_args = ['server.py', '--anomaly']
+    with patch.object(sys, 'argv', test_args):
+        args = server.parse_args()
+        assert args.anomaly == True
+
+def test_anomaly_unset():
+    test_args = ['server.py']
+    with patch.object(sys, 'argv', test_args):
+        args = server.parse_args()
+        assert args.anomaly == False
+
+# Kernel timestamps
+def test_kernel_timestamps_set():
+    test_args = ['server.py', '-k']
+    with patch.object(sys, 'argv', test_args):
+        args = server.parse_args()
+        assert args.kernel_timestamps == True
+
+def test_kernel_timestamps_unset():
+    test_args = ['server.py']
+    with patch.object(sys, 'argv', test_args):
+        args = server.parse_args()
+        assert args.kernel_timestamps == False
+
+# Shared memory transport
+def test_shm_defaults():
+    test_args = ['server.py']
+    with patch.object(sys, 'argv', test_args):
+        args = server.parse_args()
+        assert args.shm is None
+        assert args.shm_slots == 4096
+        assert args.shm_scan_interval == 500
+
+def test_shm_custom():
+    test_args = ['server.py', '--shm', 'heartbeats', '--shm-slots', '64',
+        '--shm-scan-interval', '100']
+    with patch.object(sys, 'argv', test_args):
+        args = server.parse_args()
+        assert args.shm == 'heartbeats'
+        assert args.shm_slots == 64
+        assert args.shm_scan_interval == 100
+
+# Rollups
+def test_query_port_unset():
+    test_args = ['server.py']
+    with patch.object(sys, 'argv', test_args):
+        args = server.parse_args()
+        assert args.query_port is None
+
+def test_query_port_set():
+    test_args = ['server.py', '-q', '6511']
+    with patch.object(sys, 'argv', test_args):
+        args = server.parse_args()
+        assert args.query_port == 6511
+
 
 ## Test functions
 
@@ -98,6 +182,214 @@ def test_get_timestamp_invalid_format():
         server.get_timestamp("Sending heartbeat at twenty minutes past noon. ")
 
 
+# get_gauges()
+def test_get_gauges_valid(valid_heartbeat_msg):
+    seq_num, timestamp, message = valid_heartbeat_msg
+    data = message + "Gauges load=0.5,queue=12. "
+
+    assert server.get_gauges(data) == {'load': 0.5, 'queue': 12.0}
+
+def test_get_gauges_none(valid_heartbeat_msg):
+    seq_num, timestamp, message = valid_heartbeat_msg
+    assert server.get_gauges(message) == {}
+
+def test_get_gauges_multiple_heartbeats():
+    data = ("Sequence #1: Sending heartbeat at 1752000000.1000. "
+        "Gauges load=0.5,queue=12. "
+        "Sequence #2: Sending heartbeat at 1752000000.2000. "
+        "Sequence #3: Sending heartbeat at 1752000000.3000. "
+        "Gauges queue=3. ")
+
+    # Later deltas override earlier ones
+    assert server.get_gauges(data) == {'load': 0.5, 'queue': 3.0}
+
+def test_get_gauges_truncated():
+    data = ("Sequence #1: Sending heartbeat at 1752000000.1000. "
+        "Gauges load=0.5. "
+        "Sequence #2: Sending heartbeat at 1752000000.2000. "
+        "Gauges queue=1")
+
+    assert server.get_gauges(data) == {'load': 0.5}
+
+def test_get_gauges_invalid_format(mock_logging_warn):
+    assert server.get_gauges("Gauges load,queue=3. ") == {'queue': 3.0}
+    mock_logging_warn.assert_called_once()
+
+# update_client_gauges()
+def test_update_client_gauges(valid_heartbeat_msg):
+    seq_num, timestamp, message = valid_heartbeat_msg
+    client_addr = ('127.0.0.1', 40000)
+    client_gauges = {client_addr: {'load': 0.5, 'queue': 12.0}}
+
+    result = server.update_client_gauges(client_gauges, client_addr,
+        message + "Gauges queue=3. ")
+
+    assert result == {'load': 0.5, 'queue': 3.0}
+    assert client_gauges[client_addr] == result
+
+def test_update_client_gauges_malformed(mock_logging_warn, valid_heartbeat_msg):
+    seq_num, timestamp, message = valid_heartbeat_msg
+    client_addr = ('127.0.0.1', 40000)
+    client_gauges = {client_addr: {'load': 0.5}}
+
+    result = server.update_client_gauges(client_gauges, client_addr,
+        message + "Gauges load=high,queue=3. ")
+
+    # Only the malformed gauge is dropped
+    assert result == {'load': 0.5, 'queue': 3.0}
+    mock_logging_warn.assert_called_once()
+
+# frame_messages()
+def test_frame_messages_gauges_split_across_reads():
+    chunks = ["Sequence #1: Sending heartbeat at 1752000000.1000. Gauges queue=",
+        "3. Sequence #2: Sending heartbeat at 1752000000.2000. "]
+
+    data, pending = server.frame_messages('', chunks[0])
+    assert data == "Sequence #1: Sending heartbeat at 1752000000.1000. "
+    assert pending == "Gauges queue="
+
+    data, pending = server.frame_messages(pending, chunks[1])
+    # Gauges of the first heartbeat, then the second heartbeat
+    assert server.get_gauges(data) == {'queue': 3.0}
+    assert server.get_seq_num(data) == 2
+    assert server.get_timestamp(data) == 1752000000.2
+    assert pending == ''
+
+def test_frame_messages_heartbeat_split_across_reads():
+    data, pending = server.frame_messages('', "Sequence #1: Sending heart")
+    assert data == ''
+
+    data, pending = server.frame_messages(pending, "beat at 1752000000.1000. ")
+    assert server.get_timestamp(data) == 1752000000.1
+    assert pending == ''
+
+def test_frame_messages_discards_garbage(mock_logging_warn):
+    data, pending = server.frame_messages('x' * 1000, 'x' * 100)
+
+    assert (data, pending) == ('', '')
+    mock_logging_warn.assert_called_once()
+
+# get_timestamps()
+def test_get_timestamps():
+    data = ("Sequence #1: Sending heartbeat at 1752000000.1000. "
+        "Gauges load=0.5. "
+        "Sequence #2: Sending heartbeat at 1752000000.2000. ")
+    assert server.get_timestamps(data) == [1752000000.1, 1752000000.2]
+
+def test_get_timestamps_skips_malformed():
+    data = ("Sequence #1: Sending heartbeat at soon. "
+        "Sequence #2: Sending heartbeat at 1752000000.2000. ")
+    assert server.get_timestamps(data) == [1752000000.2]
+
+# count_heartbeats()
+def test_count_heartbeats(valid_heartbeat_msg):
+    seq_num, timestamp, message = valid_heartbeat_msg
+    assert server.count_heartbeats(message) == 1
+    assert server.count_heartbeats(message * 3) == 3
+    assert server.count_heartbeats("") == 0
+
+# get_last_heartbeat()
+def test_get_last_heartbeat():
+    data = ("Sequence #1: Sending heartbeat at 1752000000.1000. "
+        "Sequence #2: Sending heartbeat at 1752000000.2000. ")
+    last = server.get_last_heartbeat(data)
+
+    assert server.get_seq_num(last) == 2
+    assert server.get_timestamp(last) == 1752000000.2
+
+def test_get_last_heartbeat_truncated():
+    data = ("Sequence #1: Sending heartbeat at 1752000000.1000. "
+        "Sequence #2: Sending heartbeat at 17520")
+    last = server.get_last_heartbeat(data)
+
+    assert server.get_seq_num(last) == 1
+
+# get_last_seq_and_timestamp()
+def test_get_last_seq_and_timestamp():
+    data = ("Sequence #1: Sending heartbeat at 1752000000.1000. "
+        "Sequence #2: Sending heartbeat at 1752000000.2000. ")
+    assert server.get_last_seq_and_timestamp(data) == (2, 1752000000.2)
+
+def test_get_last_seq_and_timestamp_falls_back_to_first():
+    # Starts with the end of a heartbeat cut short in the previous packet
+    data = ("heartbeat at 1752000000.1000. "
+        "Sequence #5: Sending heartbeat at 17520")
+    assert server.get_last_seq_and_timestamp(data) == (5, 1752000000.1)
+
+# estimate_interval()
+def test_estimate_interval():
+    assert server.estimate_interval(2, 1752000000.6, 1, 1752000000.5) == 100
+    # Gaps are spread across the missed heartbeats
+    assert server.estimate_interval(5, 1752000001.0, 1, 1752000000.0) == 250
+
+def test_estimate_interval_out_of_order():
+    assert server.estimate_interval(1, 1752000000.5, 2, 1752000000.6) is None
+
+# is_late()
+def test_is_late():
+    assert not server.is_late(1752000000.15, 1752000000.0, 100)
+    assert server.is_late(1752000000.25, 1752000000.0, 100)
+
+# compute_interval()
+def test_compute_interval_saturated():
+    assert server.compute_interval(1000, 1000, True, False, 100, 10000) == 2000
+    assert server.compute_interval(8000, 1000, True, False, 100, 10000) == 10000
+    # Never lowers the interval of a client slower than the max
+    assert server.compute_interval(20000, 20000, True, False, 100, 10000) == 20000
+
+def test_compute_interval_suspected():
+    assert server.compute_interval(1000, 1000, False, True, 100, 10000) == 500
+    assert server.compute_interval(150, 1000, False, True, 100, 10000) == 100
+    # Never raises the interval of a client faster than the min
+    assert server.compute_interval(10, 10, False, True, 100, 10000) == 10
+
+def test_compute_interval_saturation_wins():
+    assert server.compute_interval(1000, 1000, True, True, 100, 10000) == 2000
+
+def test_compute_interval_recovers():
+    assert server.compute_interval(8000, 1000, False, False, 100, 10000) == 4000
+    # Holds a backed off interval until the server has kept up for a while
+    assert server.compute_interval(2000, 1000, False, False, 100, 10000,
+        calm_packets=server.RECOVERY_PACKETS - 1) == 2000
+    assert server.compute_interval(1500, 1000, False, False, 100, 10000) == 1000
+    assert server.compute_interval(250, 1000, False, False, 100, 10000) == 1000
+    assert server.compute_interval(1000, 1000, False, False, 100, 10000) == 1000
+
+def test_compute_interval_sustained_saturation():
+    # Every third packet carries queued heartbeats. The interval must stay
+    # backed off rather than flap back to the base interval
+    interval_ms, calm_packets = 1000, 0
+    intervals = []
+    for packet in range(60):
+        saturated = packet % 3 == 0
+        calm_packets = 0 if saturated else calm_packets + 1
+
+        new_interval_ms = server.compute_interval(interval_ms, 1000, saturated,
+            False, 100, 10000, calm_packets)
+        if new_interval_ms != interval_ms:
+            calm_packets = 0
+        interval_ms = new_interval_ms
+        intervals.append(interval_ms)
+
+    assert min(intervals) == 2000
+    assert intervals[-1] == 10000
+
+# send_interval_update()
+def test_send_interval_update(mock_logging_info, mock_connection):
+    server.send_interval_update(mock_connection, 2000)
+
+    mock_connection.sendall.assert_called_once_with(b"Interval: 2000. ")
+    mock_logging_info.assert_called_once_with(
+        "Requesting heartbeat interval of 2000ms")
+
+def test_send_interval_update_broken_pipe(mock_logging_warn, mock_connection):
+    mock_connection.sendall.side_effect = BrokenPipeError("pipe broke")
+
+    server.send_interval_update(mock_connection, 2000)
+
+    mock_logging_warn.assert_called_once()
+
+
 # bind_socket_and_listen()
 def test_bind_socket_permission_error(mock_logging_error, mock_sys_exit,
     mock_socket):
@@ -139,6 +431,90 @@ def test_receive_heartbeat_empty_data(mock_logging_warn, mock_connection):
     mock_logging_warn.assert_called_once_with(
         "No data received. Connection likely closed by client.")
 
+def test_receive_heartbeat_kernel_timestamp(mock_logging_info,
+    valid_heartbeat_msg, mock_connection):
+    seq_num, timestamp, message = valid_heartbeat_msg
+
+    ancdata = [(socket.SOL_SOCKET, server.SCM_TIMESTAMPNS,
+        server.TIMESPEC.pack(1752000000, 651000000))]
+    mock_connection.recvmsg.return_value = (message.encode('utf-8'), ancdata,
+        0, None)
+
+    msg_recvd, time_recvd = server.receive_heartbeat(mock_connection, True)
+
+    assert msg_recvd == message
+    assert time_recvd == pytest.approx(1752000000.651)
+    mock_connection.recv.assert_not_called()
+
+def test_receive_heartbeat_kernel_timestamp_missing(mock_logging_info,
+    valid_heartbeat_msg, patched_time, mock_connection):
+    seq_num, timestamp, message = valid_heartbeat_msg
+
+    mock_connection.recvmsg.return_value = (message.encode('utf-8'), [], 0,
+        None)
+
+    msg_recvd, time_recvd = server.receive_heartbeat(mock_connection, True)
+
+    # Falls back to timestamping after receiving
+    assert time_recvd == patched_time
+
+# enable_kernel_timestamps()
+@patch("server.sys.platform", "linux")
+def test_enable_kernel_timestamps(mock_connection):
+    assert server.enable_kernel_timestamps(mock_connection) == True
+    mock_connection.setsockopt.assert_called_once_with(socket.SOL_SOCKET,
+        server.SO_TIMESTAMPNS, 1)
+
+@patch("server.sys.platform", "linux")
+def test_enable_kernel_timestamps_error(mock_logging_warn, mock_connection):
+    mock_connection.setsockopt.side_effect = OSError("Protocol not available")
+
+    assert server.enable_kernel_timestamps(mock_connection) == False
+    mock_logging_warn.assert_called_once()
+
+@patch("server.sys.platform", "darwin")
+def test_enable_kernel_timestamps_unsupported(mock_logging_warn,
+    mock_connection):
+    assert server.enable_kernel_timestamps(mock_connection) == False
+    mock_connection.setsockopt.assert_not_called()
+    mock_logging_warn.assert_called_once()
+
+# get_kernel_timestamp()
+def test_get_kernel_timestamp_ignores_other_messages():
+    ancdata = [(socket.SOL_SOCKET, server.SCM_TIMESTAMPNS + 1, b'\x00' * 16),
+        (socket.SOL_SOCKET, server.SCM_TIMESTAMPNS,
+            server.TIMESPEC.pack(1752000000, 500000000))]
+
+    assert server.get_kernel_timestamp(ancdata) == 1752000000.5
+
+def test_get_kernel_timestamp_missing():
+    assert server.get_kernel_timestamp([]) is None
+
+# check_heartbeat()
+def test_check_heartbeat_success(mock_logging_warn, mock_logging_debug):
+    result = server.check_heartbeat(8, 1752000000.5, 7, 1752000000.75)
+
+    assert result == 8
+    mock_logging_warn.assert_not_called()
+    mock_logging_debug.assert_called_once_with(
+        "Message took 250.0000ms to be received.")
+
+def test_check_heartbeat_with_missed_sequence(mock_logging_warn):
+    result = server.check_heartbeat(8, 1752000000.5, 5, 1752000000.75)
+
+    assert result == 8
+    mock_logging_warn.assert_called_once_with(
+        "Missed heartbeat(s) with sequence number (6, 7)")
+
+def test_check_heartbeat_records_history():
+    history = MagicMock()
+
+    server.check_heartbeat(8, 1752000000.5, 5, 1752000000.75, history,
+        '127.0.0.1:40000')
+
+    history.record.assert_called_once_with('127.0.0.1:40000', 1752000000.75,
+        250.0, 2)
+
 # analyze_heartbeat()
 def test_analyze_heartbeat_success(mock_logging_warn, mock_logging_debug,
     valid_heartbeat_msg):
@@ -166,9 +542,215 @@ def test_analyze_heartbeat_with_missed_sequence(mock_logging_warn, mock_logging_
     mock_logging_warn.assert_called_once_with(
         f"Missed heartbeat(s) with sequence number {*range(last_seq+1, seq_num),}")
 
+def test_analyze_heartbeat_records_history(valid_heartbeat_msg):
+    seq_num, timestamp, message = valid_heartbeat_msg
+    history = MagicMock()
+
+    server.analyze_heartbeat(message, seq_num - 1, float(timestamp) + 1,
+        history, '127.0.0.1:40000')
+
+    history.record.assert_called_once_with('127.0.0.1:40000',
+        float(timestamp) + 1, pytest.approx(1000.0), 0)
+
+def test_analyze_heartbeat_queued(mock_logging_warn):
+    history = MagicMock()
+    data = ("Sequence #1: Sending heartbeat at 1752000000.1000. "
+        "Sequence #2: Sending heartbeat at 1752000000.2000. "
+        "Gauges load=0.5. "
+        "Sequence #3: Sending heartbeat at 1752000000.3000. ")
+
+    result = server.analyze_heartbeat(data, 0, 1752000000.5, history,
+        '127.0.0.1:40000')
+    assert result == 3
+
+    result = server.analyze_heartbeat(
+        "Sequence #4: Sending heartbeat at 1752000000.4000. ", result,
+        1752000000.5, history, '127.0.0.1:40000')
+    assert result == 4
+
+    # One sample per heartbeat, and none of them missed
+    assert [call.args[2:] for call in history.record.call_args_list] == [
+        (pytest.approx(400.0), 0), (pytest.approx(300.0), 0),
+        (pytest.approx(200.0), 0), (pytest.approx(100.0), 0)]
+    mock_logging_warn.assert_not_called()
+
 def test_analyze_heartbeat_malformed_data(mock_logging_warn):
     bad_data = "No sequence info here"
     result = server.analyze_heartbeat(bad_data, 10, 1752000000.1234)
 
     assert result == 10
     mock_logging_warn.assert_called_once()
+
+# scan_shm_heartbeats()
+def scan_result(*rows):
+    # What reader.scan() returns for (slot, pid, seq_num, timestamp) rows
+    np = pytest.importorskip("numpy")
+    columns = list(zip(*rows)) or [(), (), (), ()]
+    return (np.array(columns[0], dtype=np.int64),
+        np.array(columns[1], dtype=np.int64),
+        np.array(columns[2], dtype=np.int64),
+        np.array(columns[3], dtype=np.float64))
+
+@pytest.fixture
+def shm_clients():
+    pytest.importorskip("numpy")
+    return server.new_shm_clients(8)
+
+def test_scan_shm_heartbeats(mock_logging_info, mock_logging_warn,
+    mock_logging_debug, shm_clients):
+    reader = MagicMock()
+
+    reader.scan.return_value = scan_result((3, 4321, 0, 0.0))  # Newly claimed
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.0)
+
+    assert shm_clients['pid'][3] == 4321
+    assert shm_clients['seq_num'][3] == 0
+    mock_logging_info.assert_called_once_with(
+        "Process 4321 attached to shared memory slot 3")
+
+    reader.scan.return_value = scan_result((3, 4321, 1, 1752000000.0))
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.001)
+
+    assert shm_clients['seq_num'][3] == 1
+    assert shm_clients['last_change'][3] == 1752000000.001
+    mock_logging_debug.assert_called_once()
+    mock_logging_warn.assert_not_called()
+
+    reader.scan.return_value = scan_result((3, 4321, 4, 1752000000.3))
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.301)
+
+    # Overwritten between scans, not lost
+    assert shm_clients['seq_num'][3] == 4
+    assert shm_clients['period_s'][3] == pytest.approx(0.1)
+    mock_logging_debug.assert_any_call(
+        "2 heartbeat(s) overwritten between scans")
+    mock_logging_warn.assert_not_called()
+
+def test_scan_shm_heartbeats_idle(shm_clients):
+    reader = MagicMock()
+    reader.scan.return_value = scan_result()
+
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.0)
+
+    assert not shm_clients['pid'].any()
+
+def test_scan_shm_heartbeats_many_clients(mock_logging_warn):
+    pytest.importorskip("numpy")
+    reader = MagicMock()
+    shm_clients = server.new_shm_clients(1000)
+    history = MagicMock()
+
+    reader.scan.return_value = scan_result(*[(slot, 1000 + slot, 0, 0.0)
+        for slot in range(1000)])
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.0)
+
+    # Every other client beats, each with its own delay
+    reader.scan.return_value = scan_result(*[(slot, 1000 + slot, 1,
+        1752000000.1 - slot / 1e6) for slot in range(0, 1000, 2)])
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.1, history)
+
+    assert shm_clients['seq_num'][::2].tolist() == [1] * 500
+    assert shm_clients['seq_num'][1::2].tolist() == [0] * 500
+    assert history.record.call_count == 500
+    assert history.record.call_args_list[10].args == ("shm:1020",
+        1752000000.1, pytest.approx(0.02, abs=0.001), 0)
+    mock_logging_warn.assert_not_called()
+
+def test_scan_shm_heartbeats_first_seen_is_baseline(mock_logging_warn,
+    shm_clients):
+    reader = MagicMock()
+    history = MagicMock()
+
+    # Client has been running since before the server started
+    reader.scan.return_value = scan_result((3, 4321, 70, 1752000000.0))
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.001, history)
+
+    reader.scan.return_value = scan_result((3, 4321, 71, 1752000000.1))
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.101, history)
+
+    mock_logging_warn.assert_not_called()
+    history.record.assert_called_once_with("shm:4321", 1752000000.101,
+        pytest.approx(1.0, abs=0.01), 0)
+
+def test_scan_shm_heartbeats_detach(mock_logging_info, shm_clients):
+    reader = MagicMock()
+    server.add_shm_client(shm_clients, 3, 4321, 10, 1752000000.0,
+        1752000000.0)
+
+    reader.scan.return_value = scan_result((3, 0, 0, 0.0))
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.0)
+
+    assert not shm_clients['pid'].any()
+    mock_logging_info.assert_called_once_with(
+        "Process 4321 detached from shared memory slot 3")
+
+def test_scan_shm_heartbeats_slot_reclaimed(mock_logging_info,
+    mock_logging_warn, shm_clients):
+    reader = MagicMock()
+    server.add_shm_client(shm_clients, 3, 4321, 10, 1752000000.0,
+        1752000000.0)
+
+    # Previous process died and its slot was claimed by a new one
+    reader.scan.return_value = scan_result((3, 5678, 1, 1752000000.0))
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.001)
+
+    assert shm_clients['pid'][3] == 5678
+    assert mock_logging_info.call_count == 2
+    mock_logging_warn.assert_not_called()
+
+def test_scan_shm_heartbeats_feeds_fleet(shm_clients):
+    anomaly = pytest.importorskip("anomaly")
+    reader = MagicMock()
+    fleet = anomaly.FleetStats(capacity=4)
+
+    reader.scan.return_value = scan_result((3, 4321, 1, 1752000000.0))
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.0, fleet=fleet)
+    reader.scan.return_value = scan_result((3, 4321, 2, 1752000000.1))
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.102,
+        fleet=fleet)
+
+    slot = fleet.slots["shm:4321"]
+    assert fleet.delay_count[slot] == 1
+    assert fleet.delay_sum[slot] == pytest.approx(2.0, abs=0.01)
+
+    reader.scan.return_value = scan_result((3, 0, 0, 0.0))
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000000.2, fleet=fleet)
+    assert len(fleet) == 0
+
+# check_shm_clients()
+@patch("server.shm.is_running", return_value=True)
+def test_check_shm_clients_silent(mock_running, mock_logging_info,
+    mock_logging_warn, shm_clients):
+    reader = MagicMock()
+    for seq_num in range(1, 4):
+        reader.scan.return_value = scan_result((3, 4321, seq_num,
+            1752000000.0 + seq_num * 0.01))
+        server.scan_shm_heartbeats(reader, shm_clients,
+            1752000000.0 + seq_num * 0.01)
+
+    server.check_shm_clients(shm_clients, 1752000000.05)
+    mock_logging_warn.assert_not_called()
+    mock_running.assert_not_called()  # Only quiet clients are looked at
+
+    # Well beyond its 10ms period, reported once
+    server.check_shm_clients(shm_clients, 1752000001.0)
+    server.check_shm_clients(shm_clients, 1752000002.0)
+    mock_logging_warn.assert_called_once_with("No heartbeat from process 4321 "
+        "in shared memory slot 3 for 0.970s")
+
+    reader.scan.return_value = scan_result((3, 4321, 4, 1752000002.0))
+    server.scan_shm_heartbeats(reader, shm_clients, 1752000002.0)
+    mock_logging_info.assert_called_with(
+        "Process 4321 in shared memory slot 3 resumed heartbeats")
+
+@patch("server.shm.is_running", return_value=False)
+def test_check_shm_clients_exited(mock_running, mock_logging_warn,
+    shm_clients):
+    server.add_shm_client(shm_clients, 3, 4321, 10, 1752000000.0,
+        1752000000.0)
+
+    server.check_shm_clients(shm_clients, 1752000001.0)
+
+    assert not shm_clients['pid'].any()
+    mock_logging_warn.assert_called_once_with("Process 4321 exited without "
+        "detaching from shared memory slot 3")
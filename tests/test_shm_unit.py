@@ -0,0 +1,201 @@
+import os
+import random
+import pytest
+
+from unittest.mock import patch
+
+shm = pytest.importorskip("shm")
+pytest.importorskip("numpy")
+
+
+# Fixtures
+@pytest.fixture
+def table_name():
+    name = f"hb_test_{os.getpid()}_{random.randint(0, 1 << 30)}"
+    yield name
+
+    try:
+        table = shm.HeartbeatTable.attach(name)
+    except FileNotFoundError:
+        return
+    table.close()
+    table.unlink()
+
+@pytest.fixture
+def reader(table_name):
+    reader = shm.ShmHeartbeatReader(table_name, 128)
+    yield reader
+    reader.close()
+
+
+# Helpers
+def scanned(reader):
+    return list(zip(*(column.tolist() for column in reader.scan())))
+
+
+## Test table
+
+def test_table_layout(reader):
+    table = reader.table
+
+    assert table.n_slots == 128
+    assert len(table.versions) == len(table.pids) == 128
+    assert len(table.seq_nums) == len(table.timestamps) == 128
+    assert table.shm.size >= shm.table_size(128)
+
+def test_attach_missing_table(table_name):
+    with pytest.raises(FileNotFoundError):
+        shm.ShmHeartbeatWriter(table_name)
+
+def test_create_reuses_existing_table(reader, table_name):
+    writer = shm.ShmHeartbeatWriter(table_name)
+    writer.beat(5, 1752000000.5)
+
+    # e.g. server restarted while clients kept running
+    reader2 = shm.ShmHeartbeatReader(table_name, 64)
+
+    assert reader2.table.n_slots == 128
+    assert scanned(reader2) == [(writer.slot, os.getpid(), 5, 1752000000.5)]
+
+    reader2.close()
+    writer.close()
+
+def test_attach_non_table(table_name):
+    from multiprocessing import shared_memory
+
+    other = shared_memory.SharedMemory(table_name, create=True, size=1024)
+    try:
+        with pytest.raises(ValueError, match="not a heartbeat table"):
+            shm.HeartbeatTable.attach(table_name)
+    finally:
+        other.close()
+        other.unlink()
+
+
+## Test writer
+
+def test_writers_claim_distinct_slots(reader, table_name):
+    writers = [shm.ShmHeartbeatWriter(table_name) for _ in range(5)]
+
+    assert sorted(w.slot for w in writers) == [0, 1, 2, 3, 4]
+
+    for writer in writers:
+        assert reader.table.pids[writer.slot] == os.getpid()
+        writer.close()
+
+def test_writer_close_frees_slot(reader, table_name):
+    writer = shm.ShmHeartbeatWriter(table_name)
+    slot = writer.slot
+    writer.close()
+
+    assert reader.table.pids[slot] == 0
+
+    writer = shm.ShmHeartbeatWriter(table_name)
+    assert writer.slot == slot
+    writer.close()
+
+@patch("shm.is_running", return_value=False)
+def test_writer_reclaims_dead_slot(mock_running, reader, table_name):
+    reader.table.pids[0] = 999999999  # Process exited without closing
+
+    writer = shm.ShmHeartbeatWriter(table_name)
+
+    assert writer.slot == 0
+    assert reader.table.pids[0] == os.getpid()
+    writer.close()
+
+@patch("shm.is_running", return_value=True)
+def test_writer_table_full(mock_running, table_name):
+    reader = shm.ShmHeartbeatReader(table_name, 2)
+    reader.table.pids[0] = reader.table.pids[1] = 1
+
+    with pytest.raises(RuntimeError, match="No free slot"):
+        shm.ShmHeartbeatWriter(table_name)
+
+    reader.close()
+
+def test_writer_beat(reader, table_name):
+    writer = shm.ShmHeartbeatWriter(table_name)
+    version = reader.table.versions[writer.slot]
+
+    time_sent = writer.beat(7)
+
+    assert reader.table.seq_nums[writer.slot] == 7
+    assert reader.table.timestamps[writer.slot] == time_sent
+    assert reader.table.versions[writer.slot] == version + 2  # Even when done
+    writer.close()
+
+
+## Test reader
+
+def test_scan_idle(reader):
+    assert scanned(reader) == []
+
+def test_scan_reports_each_write_once(reader, table_name):
+    writer = shm.ShmHeartbeatWriter(table_name)
+
+    # Newly claimed slot
+    assert scanned(reader) == [(writer.slot, os.getpid(), 0, 0.0)]
+
+    writer.beat(1, 1752000000.1)
+    writer.beat(2, 1752000000.2)
+
+    # Only the latest heartbeat is visible
+    assert scanned(reader) == [(writer.slot, os.getpid(), 2, 1752000000.2)]
+    assert scanned(reader) == []
+    writer.close()
+
+def test_scan_many_slots(table_name):
+    reader = shm.ShmHeartbeatReader(table_name, 1000)
+    writers = [shm.ShmHeartbeatWriter(table_name) for _ in range(300)]
+    reader.scan()
+
+    beating = writers[::7]
+    for writer in beating:
+        writer.beat(1, 1752000000.0)
+
+    assert [slot for slot, *_ in scanned(reader)] == [w.slot for w in beating]
+
+    for writer in writers:
+        writer.close()
+    reader.close()
+
+def test_scan_skips_slot_mid_write(reader, table_name):
+    writer = shm.ShmHeartbeatWriter(table_name)
+    reader.scan()
+
+    table = reader.table
+    version = table.versions[writer.slot]
+    table.versions[writer.slot] = version + 1  # Writer interrupted mid-write
+    table.seq_nums[writer.slot] = 3
+
+    assert scanned(reader) == []
+
+    table.timestamps[writer.slot] = 1752000000.3
+    table.versions[writer.slot] = version + 2
+
+    assert scanned(reader) == [(writer.slot, os.getpid(), 3, 1752000000.3)]
+    writer.close()
+
+def test_release_removes_unused_table(table_name):
+    reader = shm.ShmHeartbeatReader(table_name, 16)
+    writer = shm.ShmHeartbeatWriter(table_name)
+    writer.close()
+
+    assert reader.release()
+
+    with pytest.raises(FileNotFoundError):
+        shm.HeartbeatTable.attach(table_name)
+    assert not os.path.exists(shm.lock_path(table_name))
+
+def test_release_keeps_table_in_use(table_name):
+    reader = shm.ShmHeartbeatReader(table_name, 16)
+    writer = shm.ShmHeartbeatWriter(table_name)
+
+    # Left for the next server, so the client keeps working
+    assert not reader.release()
+
+    reader = shm.ShmHeartbeatReader(table_name, 16)
+    assert reader.table.pids[writer.slot] == os.getpid()
+    writer.close()
+    assert reader.release()